@@ -1,15 +1,41 @@
+import io
 import json
-from typing import Any, Optional
+from json.encoder import encode_basestring_ascii as json_str
+from typing import Any, Iterator, Optional, Sequence, TextIO
 
 from instruction.const import ConstOpType
+from instruction.ssa import SsaOpType
 from logger.logger import logger
 from instruction.common import ValType
 from instruction.instruction import Instruction, ConstInst, ValueOperationInst, EffectOperationInst, LabelInst
 
+try:
+    import orjson
+except ImportError:  # optional, fall back to json
+    orjson = None
+
+def json_strs(strs: list[str]) -> str:
+    """Compact JSON array of strings `strs`
+    """
+    return '[' + ','.join(map(json_str, strs)) + ']'
+
+def json_value(value: Any) -> str:
+    """Compact JSON of a constant `value`
+    """
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if type(value) is int:
+        return str(value)
+    return json.dumps(value, separators=(',', ':'))
+
 class Const(Instruction):
     """Constant assignment instruction
     """
     
+    __slots__ = ('dest', 'type', 'value')
+
     def __init__(self, instr: ConstInst):
         super().__init__(instr)
         # guardian, check validity
@@ -47,6 +73,12 @@ class Const(Instruction):
         result['value'] = self.value
         return result
 
+    def to_json(self) -> str:
+        """Compact JSON of this instruction, same as `to_dict` without building it
+        """
+        return (f'{{"op":"const","dest":{json_str(self.dest)},"type":{json_str(self.type.value)}'
+                f',"value":{json_value(self.value)}}}')
+
 class ValueOperation(Instruction):
     """Instruction that definitely has destination (value assignment)
     e.g.
@@ -56,6 +88,8 @@ class ValueOperation(Instruction):
     * x = phi(...) (phi function)
     """
     
+    __slots__ = ('dest', 'type', 'args', 'funcs', 'labels')
+
     def __init__(self, instr: ValueOperationInst):
         super().__init__(instr)
 
@@ -91,26 +125,100 @@ class ValueOperation(Instruction):
         
         self.dest = dest
         self.type = tp
-        self.args = args
+        self.args = tuple(args) if args is not None else None
         self.funcs = funcs
-        self.labels = labels
+        self.labels = tuple(labels) if labels is not None else None
 
     def to_dict(self) -> dict[str, Any]:
         result = super().to_dict()
         result['dest'] = self.dest
         result['type'] = self.type.value
         if self.args:
-            result['args'] = self.args
+            result['args'] = list(self.args)
         if self.funcs:
             result['funcs'] = self.funcs
         if self.labels:
-            result['labels'] = self.labels
+            result['labels'] = list(self.labels)
         return result
 
+    def to_json(self) -> str:
+        """Compact JSON of this instruction, same as `to_dict` without building it
+        """
+        text = f'{{"op":{json_str(self.op.value)},"dest":{json_str(self.dest)},"type":{json_str(self.type.value)}'
+        args, labels = self.args, self.labels
+        if args:
+            text += f',"args":{json_strs(args)}'
+        if self.funcs:
+            text += f',"funcs":{json_strs(self.funcs)}'
+        if labels:
+            text += f',"labels":{json_strs(labels)}'
+        return text + '}'
+
+class Phi(ValueOperation):
+    """Phi function `dest = phi(...)` for source variable `var`,
+    with its operands kept as a `predecessor label:value` map
+
+    `args` and `labels` are read-only tuple snapshots of `operands` in
+    insertion order, so it serializes to the same Bril JSON as a plain phi
+    `ValueOperation`; edit `operands` or assign them whole to change it.
+    """
+
+    __slots__ = ('operands', 'var')
+
+    def __init__(self, instr: ValueOperationInst, var: Optional[str] = None):
+        args = instr.get('args') or []
+        labels = instr.get('labels') or []
+        self.operands: dict[str, str] = dict(zip(labels, args))
+        """`predecessor label:value` map
+        """
+        super().__init__(instr)
+        # guardian, check validity
+        if self.op != SsaOpType.PHI:
+            err = ValueError(f"Invalid {type(self)} construction: op: {self.op} is not {SsaOpType.PHI}")
+            logger.error(err)
+            raise err
+        if len(args) != len(labels) or len(self.operands) != len(labels):
+            err = ValueError(f"Invalid {type(self)} construction: args: {args} don't pair with distinct labels: {labels}")
+            logger.error(err)
+            raise err
+
+        self.var = var if var is not None else self.dest
+        """source variable this phi function merges
+        """
+
+    @property
+    def args(self) -> tuple[str, ...]:
+        return tuple(self.operands.values())
+
+    @args.setter
+    def args(self, args: Optional[Sequence[str]]):
+        args = args or ()
+        if len(args) != len(self.operands):
+            err = ValueError(f"Invalid {type(self)} args: {args} don't pair with labels: {list(self.operands)}")
+            logger.error(err)
+            raise err
+        self.operands = dict(zip(self.operands, args))
+
+    @property
+    def labels(self) -> tuple[str, ...]:
+        return tuple(self.operands)
+
+    @labels.setter
+    def labels(self, labels: Optional[Sequence[str]]):
+        labels = labels or ()
+        operands = dict(zip(labels, self.operands.values()))
+        if len(labels) != len(self.operands) or len(operands) != len(labels):
+            err = ValueError(f"Invalid {type(self)} labels: {labels} don't pair distinctly with args: {list(self.operands.values())}")
+            logger.error(err)
+            raise err
+        self.operands = operands
+
 class EffectOperation(Instruction):
     """Instruction that has side effect without value assignment
     """
     
+    __slots__ = ('args', 'funcs', 'labels')
+
     def __init__(self, instr: EffectOperationInst):
         super().__init__(instr)
         # guardian, check validity
@@ -137,24 +245,38 @@ class EffectOperation(Instruction):
             logger.error(err)
             raise err
         
-        self.args = args
+        self.args = tuple(args) if args is not None else None
         self.funcs = funcs
-        self.labels = labels
+        self.labels = tuple(labels) if labels is not None else None
 
     def to_dict(self) -> dict[str, Any]:
         result = super().to_dict()
         if self.args:
-            result['args'] = self.args
+            result['args'] = list(self.args)
         if self.funcs:
             result['funcs'] = self.funcs
         if self.labels:
-            result['labels'] = self.labels
+            result['labels'] = list(self.labels)
         return result
 
+    def to_json(self) -> str:
+        """Compact JSON of this instruction, same as `to_dict` without building it
+        """
+        text = f'{{"op":{json_str(self.op.value)}'
+        if self.args:
+            text += f',"args":{json_strs(self.args)}'
+        if self.funcs:
+            text += f',"funcs":{json_strs(self.funcs)}'
+        if self.labels:
+            text += f',"labels":{json_strs(self.labels)}'
+        return text + '}'
+
 class Label(Instruction):
     """Pure label, not a real instruction
     """
     
+    __slots__ = ('label',)
+
     def __init__(self, instr: LabelInst):
         super().__init__(instr)
         label = instr.get('label')
@@ -168,7 +290,16 @@ class Label(Instruction):
     def to_dict(self) -> dict[str, Any]:
         return { 'label': self.label }
 
+    def to_json(self) -> str:
+        return f'{{"label":{json_str(self.label)}}}'
+
 class Function:
+    """A Bril function, its instructions are parsed on first access of `instrs`
+
+    Until then the JSON instructions are kept as given, and `to_dict` and
+    `write_json` pass them through, so functions only copied are never parsed.
+    """
+
     def __init__(self, func: dict[str, Any]):
         self.name = func.get('name')
         args: Optional[list[dict[str, str]]] = func.get('args', [])
@@ -178,7 +309,30 @@ class Function:
             raise err
         self.args = args
         self.type = func.get('type')
-        self.instrs = [self._parse_instr(instr) for instr in func.get('instrs', [])]
+        self._raw_instrs: Optional[list[dict[str, Any]]] = func.get('instrs', [])
+        """JSON instructions, until they are parsed
+        """
+        self._instrs: Optional[list[Instruction]] = None
+
+    @property
+    def instrs(self) -> list[Instruction]:
+        """instructions of this function, parsed from the JSON on first access
+        """
+        if self._instrs is None:
+            self._instrs = [self._parse_instr(instr) for instr in self._raw_instrs]
+            self._raw_instrs = None
+        return self._instrs
+
+    @instrs.setter
+    def instrs(self, instrs: list[Instruction]):
+        self._instrs = instrs
+        self._raw_instrs = None
+
+    @property
+    def parsed(self) -> bool:
+        """whether the instructions have been parsed or replaced
+        """
+        return self._raw_instrs is None
 
     def _parse_instr(self, instr: dict[str, Any]) -> Instruction:
         if 'label' in instr:
@@ -187,6 +341,8 @@ class Function:
             op = instr.get('op')
             if op == 'const':
                 return Const(instr)
+            elif op == SsaOpType.PHI.value:
+                return Phi(instr)
             elif 'dest' in instr:
                 return ValueOperation(instr)
             else:
@@ -198,12 +354,34 @@ class Function:
             result['args'] = self.args
         if self.type is not None:
             result['type'] = self.type
+        if self._raw_instrs is not None:  # untouched
+            result['instrs'] = self._raw_instrs
+            return result
         if self.instrs is None:
             logger.error(self.name)
             logger.flush()
         result['instrs'] = [instr.to_dict() for instr in self.instrs]
         return result
 
+    def write_json(self, out: TextIO):
+        """Write compact JSON of this function to `out` instruction by instruction,
+        same as `to_dict` without building it
+        """
+        out.write(f'{{"name":{json_str(self.name)}')
+        if self.args:
+            out.write(f',"args":{json.dumps(self.args, separators=(",", ":"))}')
+        if self.type is not None:
+            out.write(f',"type":{json.dumps(self.type, separators=(",", ":"))}')
+        if self._raw_instrs is not None:  # untouched
+            out.write(f',"instrs":{json.dumps(self._raw_instrs, separators=(",", ":"))}}}')
+            return
+        out.write(',"instrs":[')
+        for n, instr in enumerate(self.instrs):
+            if n > 0:
+                out.write(',')
+            out.write(instr.to_json())
+        out.write(']}')
+
 class Program:
     def __init__(self, prog: dict[str, Any]):
         self.functions = [Function(func) for func in prog.get('functions', [])]
@@ -211,9 +389,119 @@ class Program:
     def to_dict(self) -> dict[str, Any]:
         return {'functions': [func.to_dict() for func in self.functions]}
 
+    def write_json(self, out: TextIO):
+        """Write compact JSON of this program to `out`, see `Function.write_json`
+        """
+        out.write('{"functions":[')
+        for n, func in enumerate(self.functions):
+            if n > 0:
+                out.write(',')
+            func.write_json(out)
+        out.write(']}')
+
 def parse_bril(json_str: str) -> Program:
     prog = json.loads(json_str)
     return Program(prog)
 
-def serialize_bril(prog: Program) -> str:
-    return json.dumps(prog.to_dict(), indent=2)
\ No newline at end of file
+class FunctionReader:
+    """Incremental parser of the `functions` array of a Bril JSON program
+
+    Iterating yields the functions one at a time as `dict`s, reading only as
+    much input as the function being parsed needs, so memory is bounded
+    by the largest function instead of the whole program.
+    """
+
+    def __init__(self, f: TextIO, chunk_size: int = 1 << 16):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """Read more input, at least as much as is buffered,
+        so a long value is decoded in amortized linear time
+        """
+        chunk = self.f.read(max(self.chunk_size, len(self.buf) - self.pos))
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        self.eof = len(chunk) == 0
+
+    def _peek(self) -> str:
+        """Next non-whitespace character, empty at the end of input
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos:self.pos + 1]
+            self._fill()
+
+    def _expect(self, chars: str) -> str:
+        c = self._peek()
+        if c == '' or c not in chars:
+            err = ValueError(f"Invalid Bril JSON: expect one of {chars!r} but got {c!r}")
+            logger.error(err)
+            raise err
+        self.pos += 1
+        return c
+
+    def _value(self) -> Any:
+        while True:
+            self._peek()
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self._fill()
+                continue
+            if end == len(self.buf) and not self.eof:
+                self._fill()  # a number may go on in the next chunk
+                continue
+            self.pos = end
+            return value
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        self._expect('{')
+        if self._peek() == '}':
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            if key != 'functions':
+                self._value()
+            else:
+                self._expect('[')
+                if self._peek() == ']':
+                    self.pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._expect(',]') == ']':
+                            break
+            if self._expect(',}') == '}':
+                return
+
+def dumps_json(obj: Any, compact: bool = False) -> str:
+    """JSON text of `obj`, indented by 2 spaces unless `compact`
+
+    Uses orjson when installed, which keeps non-ASCII characters
+    instead of escaping them, and falls back to json otherwise.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=None if compact else orjson.OPT_INDENT_2).decode()
+        except TypeError:  # e.g. integers beyond 64 bits
+            pass
+    if compact:
+        return json.dumps(obj, separators=(',', ':'))
+    return json.dumps(obj, indent=2)
+
+def serialize_bril(prog: Program, compact: bool = False) -> str:
+    if compact and orjson is None:
+        out = io.StringIO()
+        prog.write_json(out)
+        return out.getvalue()
+    return dumps_json(prog.to_dict(), compact)
\ No newline at end of file
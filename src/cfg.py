@@ -1,17 +1,25 @@
+from array import array
 from collections import OrderedDict
-from bril import Const, EffectOperation, Function, Instruction, Label, ValueOperation
+from collections.abc import Set
+from typing import Iterable, Optional
+from bril import Const, EffectOperation, Function, Instruction, Label, Phi, ValueOperation
 from instruction.value import NullityType
 from instruction.common import OpType, ValType
 from instruction.ssa import SsaOpType
 from instruction.control import CtrlOpType
 from instruction.instruction import Instruction
 from logger.logger import logger
-from util import Convertor, new_name
+from util import Convertor, NameGenerator, iter_bits
 
 class BasicBlock:
     def __init__(self, label: str, insts: list[Instruction] = None):
         self.label = label
         self.insts = insts if insts is not None else []
+        self.phis: dict[str, Phi] = {}
+        """`variable:phi` map of the phi functions placed in this block,
+        kept apart from `insts`, in placement order until `ordered_phis` sorts it
+        """
+        self._phis_sorted = True
         self.preds: set['BasicBlock'] = set()
         """predecessor blocks
         """
@@ -23,40 +31,51 @@ class BasicBlock:
         return f'BasicBlock({self.label})'
     
     def get_by_op(self, op: OpType) -> list[Instruction]:
-        """Query all instructions by op: `OpType` in instruction order
+        """Query all instructions by op: `OpType` in instruction order,
+        placed phi functions come first
 
         Args:
             op (OpType): operation type to search
         """
-        return [ i for i in self.insts if i.op == op ]
+        found = [ i for i in self.insts if i.op == op ]
+        if op == SsaOpType.PHI:
+            return self.ordered_phis() + found
+        return found
 
     def insert_phi_if_not_exist_for(self, var: str, tp: ValType = NullityType.UNKNOWN):
-        pos = 0
-        for i in self.insts:
-            if hasattr(i, 'dest') and isinstance(i.dest, str) and i.dest == var:
-                if i.op == SsaOpType.PHI:
-                    return False
-                else:
-                    possible_types = (ValueOperation, Const)
-                    if not isinstance(i, possible_types):
-                        err = ValueError(f"Invalid instruction {i} has dest but not in {possible_types}")
-                        logger.error(err)
-                        raise err
-            if i.op == SsaOpType.PHI and i.dest < var:
-                pos += 1
-                
-        # phi for var DNE, insert one
-        self.insts.insert(pos, ValueOperation({
-            "op": SsaOpType.PHI, "args": [], "labels": [],
-            "dest": var, "type": tp }))
+        """Place an empty phi function for `var` unless there is one already
+
+        Returns:
+            bool: whether a new phi function is inserted
+        """
+        if var in self.phis:
+            return False
+        if self._phis_sorted and len(self.phis) != 0 and next(reversed(self.phis)) > var:
+            self._phis_sorted = False
+        self.phis[var] = Phi({ "op": SsaOpType.PHI, "dest": var, "type": tp }, var)
         return True
-                
+
+    def ordered_phis(self) -> list[Phi]:
+        """Phi functions of this block ordered by variable,
+        `phis` is sorted once after out-of-order placements
+        """
+        if not self._phis_sorted:
+            self.phis = { k: self.phis[k] for k in sorted(self.phis) }
+            self._phis_sorted = True
+        return list(self.phis.values())
+
+    def instructions(self) -> list[Instruction]:
+        """Phi functions followed by the body of this block
+        """
+        return self.ordered_phis() + self.insts
+
 
 class Inst2BasicBlockDict(Convertor):
     @classmethod
     def _name_basic_block(cls,
                           insts: list[Instruction],
-                          named_bb: OrderedDict[str, BasicBlock]):
+                          named_bb: OrderedDict[str, BasicBlock],
+                          label_names: NameGenerator):
         """Construct a BasicBlock, named it to its label.
         if it doesn't have label, give it a new name,
         and store it into `named_bb`
@@ -64,6 +83,7 @@ class Inst2BasicBlockDict(Convertor):
         Args:
             insts (list[Instruction]): instructions to form a basic block
             named_bb (dict[str, BasicBlock]): named list (OrderedDict) of `label:BasicBlock` pair 
+            label_names (NameGenerator): labels taken in the function
         """
         name: str
         first_inst = insts[0]
@@ -71,33 +91,44 @@ class Inst2BasicBlockDict(Convertor):
             name = first_inst.label
             insts = insts[1:]
         else:
-            name = new_name('b', named_bb)
+            name = label_names.new_name('b')
         named_bb[name] = BasicBlock(name, insts)
     
     @classmethod
-    def convert(cls, insts: list[Instruction]) -> OrderedDict[str, BasicBlock]:
+    def convert(cls,
+                insts: list[Instruction],
+                label_names: Optional[NameGenerator] = None) -> OrderedDict[str, BasicBlock]:
         """Convert a list of instructions to a named list (OrderedDict) of `label:BasicBlock` pair
+
+        Args:
+            insts (list[Instruction]): instructions of a function
+            label_names (NameGenerator, optional): labels taken in the function,
+                collected from `insts` if not given
         """
+        if label_names is None:
+            label_names = NameGenerator(i.label for i in insts if isinstance(i, Label))
         named_bb: OrderedDict[str, BasicBlock] = OrderedDict()
         collector = []
         for i in insts:
             if isinstance(i, Label):
                 if len(collector) != 0:
-                    cls._name_basic_block(collector, named_bb)
+                    cls._name_basic_block(collector, named_bb, label_names)
                 collector = [i]
             else:
                 collector.append(i)
                 # If end of BasicBlock detected
                 if i.op.is_block_terminator:
-                    cls._name_basic_block(collector, named_bb)
+                    cls._name_basic_block(collector, named_bb, label_names)
                     collector = []
         if len(collector) != 0:
-            cls._name_basic_block(collector, named_bb)
+            cls._name_basic_block(collector, named_bb, label_names)
         return named_bb
 
 class BasicBlockDict2Cfg(Convertor):
     @classmethod
-    def _add_first_block_if_need(cls, named_bb: OrderedDict[str, BasicBlock]):
+    def _add_first_block_if_need(cls,
+                                 named_bb: OrderedDict[str, BasicBlock],
+                                 label_names: NameGenerator):
         first_bb = next(iter(named_bb.keys()))
         for bb in named_bb.values():
             if any(isinstance(i, (ValueOperation, EffectOperation))
@@ -106,7 +137,7 @@ class BasicBlockDict2Cfg(Convertor):
                 for i in bb.insts):
                 # there is at least one reference to the first bb
                 # -> create a pure entry without in-edge
-                leading = BasicBlock(new_name('fresh', named_bb))
+                leading = BasicBlock(label_names.new_name('fresh'))
                 # Add a psudo leading BB and move it to the front of OrderedDict
                 named_bb[leading.label] = leading
                 named_bb.move_to_end(leading.label, last=False)
@@ -160,17 +191,23 @@ class BasicBlockDict2Cfg(Convertor):
                     named_bb[label].preds.add(bb)
     
     @classmethod
-    def convert(cls, named_bb: OrderedDict[str, BasicBlock]) -> BasicBlock:
+    def convert(cls,
+                named_bb: OrderedDict[str, BasicBlock],
+                label_names: Optional[NameGenerator] = None) -> BasicBlock:
         """Use `named_bb` to construct a CFG
 
         Args:
             named_bb (OrderedDict[str, BasicBlock]):
                 named list (OrderedDict) of `name:BasicBlock`
+            label_names (NameGenerator, optional): labels taken in the function,
+                the keys of `named_bb` if not given
 
         Returns:
             BasicBlock: leading `BasicBlock` in CFG
         """
-        cls._add_first_block_if_need(named_bb)
+        if label_names is None:
+            label_names = NameGenerator(named_bb)
+        cls._add_first_block_if_need(named_bb, label_names)
         cls._patch_and_link(named_bb)
         cls._link_back_pred(named_bb)
         # return the first BB
@@ -182,14 +219,18 @@ class CFG:
         self.function = function
         # TODO: Implement CFG construction logic
         # 1. Divide instructions into basic blocks.
-        self.blocks = Inst2BasicBlockDict.convert(self.function.instrs)
+        self.label_names = NameGenerator(i.label for i in function.instrs if isinstance(i, Label))
+        """labels taken in this `CFG`, to name new blocks
+        """
+        self.blocks = Inst2BasicBlockDict.convert(self.function.instrs, self.label_names)
         """`label:BasicBlock` map
         """
         # 2. Establish successor and predecessor relationships.
         # 3. Handle labels and control flow instructions.
-        self.entry_block = BasicBlockDict2Cfg.convert(self.blocks)
+        self.entry_block = BasicBlockDict2Cfg.convert(self.blocks, self.label_names)
         """The first block of this `CFG`
         """
+        self._index: Optional[CfgIndex] = None
         
     def view_blocks(self):
         for bb in self.blocks.values():
@@ -199,5 +240,225 @@ class CFG:
 
     def get_blocks(self) -> list[BasicBlock]:
         return list(self.blocks.values())
-    
-    
+
+    @property
+    def index(self) -> 'CfgIndex':
+        """Frozen, index based view of this `CFG`, built on first access
+        """
+        if self._index is None:
+            self._index = CfgIndex(self)
+        return self._index
+
+    def invalidate_index(self):
+        """Drop the cached `index`, call it after editing blocks or edges
+        """
+        self._index = None
+
+    def reverse_postorder(self) -> list[BasicBlock]:
+        """Blocks reachable from `entry_block` in reverse postorder
+
+        Successors are visited in block order, so the result is deterministic.
+        Unreachable blocks are not included.
+        """
+        return self.index.blocks[:self.index.n_reachable]
+
+class CfgIndex:
+    """Frozen, index based view of a `CFG`
+
+    Blocks are numbered `0..n-1`: reachable blocks in reverse postorder
+    (so the entry block is `0`), followed by unreachable blocks in block order.
+    Predecessors and successors are stored in CSR form: the successors of
+    block `i` are `succ_idx[succ_off[i]:succ_off[i + 1]]`, likewise for predecessors.
+    """
+
+    def __init__(self, cfg: CFG):
+        self.cfg = cfg
+        by_pos = list(cfg.blocks.values())
+        position = { bb: n for n, bb in enumerate(by_pos) }
+        # successors in block order, so the numbering is deterministic
+        succ_pos = [sorted(position[s] for s in bb.succs) for bb in by_pos]
+        self._number(by_pos, succ_pos, position[cfg.entry_block])
+
+    def _number(self, by_pos: list, succ_pos: list[list[int]], entry: int):
+        """Number blocks `by_pos` given the sorted successor positions of each
+        and the position of the entry block, then build the CSR adjacency
+        """
+        # iterative DFS to get the reverse postorder of reachable blocks
+        postorder: list[int] = []
+        visited = [False] * len(by_pos)
+        visited[entry] = True
+        stack = [(entry, iter(succ_pos[entry]))]
+        while len(stack) > 0:
+            v, succs = stack[-1]
+            for s in succs:
+                if not visited[s]:
+                    visited[s] = True
+                    stack.append((s, iter(succ_pos[s])))
+                    break
+            else:
+                stack.pop()
+                postorder.append(v)
+        order = postorder[::-1]
+        self.n_reachable = len(order)
+        """number of blocks reachable from the entry block
+        """
+        order.extend(n for n in range(len(by_pos)) if not visited[n])
+
+        self.blocks: list[BasicBlock] = [by_pos[n] for n in order]
+        """index: `BasicBlock` table
+        """
+        self.label2idx: dict[str, int] = { bb.label: i for i, bb in enumerate(self.blocks) }
+        """label: index table
+        """
+        pos2idx = [0] * len(by_pos)
+        for i, n in enumerate(order):
+            pos2idx[n] = i
+
+        self.succ_off = array('i', [0])
+        self.succ_idx = array('i')
+        pred_lists: list[list[int]] = [[] for _ in order]
+        for i, n in enumerate(order):
+            for s in sorted(pos2idx[s] for s in succ_pos[n]):
+                self.succ_idx.append(s)
+                pred_lists[s].append(i)
+            self.succ_off.append(len(self.succ_idx))
+        self.pred_off = array('i', [0])
+        self.pred_idx = array('i')
+        for preds in pred_lists:
+            self.pred_idx.extend(preds)
+            self.pred_off.append(len(self.pred_idx))
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def succs(self, i: int) -> array:
+        """Indices of the successors of block `i`
+        """
+        return self.succ_idx[self.succ_off[i]:self.succ_off[i + 1]]
+
+    def preds(self, i: int) -> array:
+        """Indices of the predecessors of block `i`
+        """
+        return self.pred_idx[self.pred_off[i]:self.pred_off[i + 1]]
+
+    def n_edges(self) -> int:
+        return len(self.succ_idx)
+
+    def index_of(self, bb: BasicBlock) -> int:
+        return self.label2idx[bb.label]
+
+    def bits_of(self, bbs: Iterable[BasicBlock]) -> int:
+        """Bitset over block indices of `bbs`
+        """
+        bits = 0
+        for bb in bbs:
+            bits |= 1 << self.label2idx[bb.label]
+        return bits
+
+    def block_set(self, bits: int) -> 'BlockSet':
+        return BlockSet(self.blocks, self.label2idx, bits)
+
+class EditableCfgIndex(CfgIndex):
+    """Mutable copy of a `CfgIndex` for incremental analyses
+
+    Block indices stay stable across edits and new blocks are appended,
+    so the numbering is no longer a reverse postorder once edited, and
+    there is no `n_reachable`. Backends relying on it (`Cfg2Dom`, `Cfg2Idom`)
+    need a fresh `CfgIndex` of the edited `CFG`, semi-NCA walks any index.
+    Adjacency is kept as lists instead of CSR arrays.
+    """
+
+    def __init__(self, index: CfgIndex):
+        self.cfg = index.cfg
+        self.blocks = list(index.blocks)
+        self.label2idx = dict(index.label2idx)
+        self.succ_lists: list[list[int]] = [list(index.succs(i)) for i in range(len(index))]
+        self.pred_lists: list[list[int]] = [list(index.preds(i)) for i in range(len(index))]
+
+    @property
+    def n_reachable(self) -> int:
+        err = ValueError("An edited CfgIndex is not in reverse postorder, use a fresh CfgIndex of the CFG")
+        logger.error(err)
+        raise err
+
+    def succs(self, i: int) -> list[int]:
+        return self.succ_lists[i]
+
+    def preds(self, i: int) -> list[int]:
+        return self.pred_lists[i]
+
+    def n_edges(self) -> int:
+        return sum(map(len, self.succ_lists))
+
+    def add_block(self, bb: BasicBlock) -> int:
+        """Append `bb` without edges, returns its index
+        """
+        self.label2idx[bb.label] = len(self.blocks)
+        self.blocks.append(bb)
+        self.succ_lists.append([])
+        self.pred_lists.append([])
+        return len(self.blocks) - 1
+
+    def has_edge(self, u: int, v: int) -> bool:
+        return v in self.succ_lists[u]
+
+    def add_edge(self, u: int, v: int):
+        self.succ_lists[u].append(v)
+        self.pred_lists[v].append(u)
+
+    def remove_edge(self, u: int, v: int):
+        self.succ_lists[u].remove(v)
+        self.pred_lists[v].remove(u)
+
+class BlockSet(Set):
+    """Read-only set of `BasicBlock` backed by a bitset `bits` over block indices
+
+    Compares equal to a regular `set` of the same blocks, set operators
+    with other `BlockSet`s of the same numbering stay in bitset form.
+    """
+    __slots__ = ('blocks', 'label2idx', 'bits')
+
+    def __init__(self, blocks: list[BasicBlock], label2idx: dict[str, int], bits: int):
+        self.blocks = blocks
+        self.label2idx = label2idx
+        self.bits = bits
+
+    def __contains__(self, bb: object) -> bool:
+        i = self.label2idx.get(getattr(bb, 'label', None))
+        return i is not None and self.blocks[i] is bb and (self.bits >> i) & 1 == 1
+
+    def __iter__(self):
+        return (self.blocks[i] for i in iter_bits(self.bits))
+
+    def __len__(self):
+        return self.bits.bit_count()
+
+    def __repr__(self):
+        return f'BlockSet({ {bb.label for bb in self} })'
+
+    def _same_numbering(self, other: object) -> bool:
+        return isinstance(other, BlockSet) and other.blocks is self.blocks
+
+    def __eq__(self, other: object) -> bool:
+        if self._same_numbering(other):
+            return self.bits == other.bits
+        return super().__eq__(other)
+
+    def __and__(self, other):
+        if self._same_numbering(other):
+            return BlockSet(self.blocks, self.label2idx, self.bits & other.bits)
+        return super().__and__(other)
+
+    def __or__(self, other):
+        if self._same_numbering(other):
+            return BlockSet(self.blocks, self.label2idx, self.bits | other.bits)
+        return super().__or__(other)
+
+    def __sub__(self, other):
+        if self._same_numbering(other):
+            return BlockSet(self.blocks, self.label2idx, self.bits & ~other.bits)
+        return super().__sub__(other)
+
+    @classmethod
+    def _from_iterable(cls, it):
+        return set(it)
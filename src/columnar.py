@@ -0,0 +1,554 @@
+from array import array
+from typing import Any, Iterable, Optional
+from bril import Function, Label
+from cfg import CfgIndex
+from dominance import DominatorTree
+from instruction.common import OpType, ValType
+from instruction.const import ConstOpType
+from instruction.control import CtrlOpType
+from instruction.ssa import SsaOpType
+from instruction.value import NullityType
+from liveness import Liveness, VarIndex
+from logger.logger import logger
+from ssa_construct import SSA_MODES
+from util import NameGenerator, iter_bits
+
+LABEL = 0
+"""opcode of a label, the others index `OPS`
+"""
+OPS: list[Optional[OpType]] = [None, *OpType.cases().values()]
+"""operator of each opcode
+"""
+OPCODES: dict[OpType, int] = { op: code for code, op in enumerate(OPS) if op is not None }
+"""opcode of each operator
+"""
+TYPES: list[ValType] = list(ValType.cases().values())
+"""value type of each type code
+"""
+TYPE_CODES: dict[ValType, int] = { tp: code for code, tp in enumerate(TYPES) }
+"""type code of each value type
+"""
+NONE = -1
+"""dest or type code of an instruction that has none
+"""
+CONST, PHI, JMP, BR, RET = (OPCODES[op] for op in (ConstOpType.CONST, SsaOpType.PHI,
+                                                   CtrlOpType.JMP, CtrlOpType.BR, CtrlOpType.RET))
+TERMINATORS = frozenset(OPCODES[op] for op in OPCODES if op.is_block_terminator)
+"""opcodes ending a block
+"""
+COLUMNS = ('ops', 'types', 'dests', 'arg_off', 'arg_ids',
+           'label_off', 'label_ids', 'func_off', 'func_ids', 'consts')
+"""instruction storage of a `ColumnarFunction`
+"""
+
+class ColumnarFunction:
+    """A Bril function stored as struct-of-arrays, without an object per instruction
+
+    Instruction `n` has opcode `ops[n]`, type code `types[n]` and dest `dests[n]`,
+    `NONE` if it has none. Its args are `arg_ids[arg_off[n]:arg_off[n + 1]]`,
+    likewise its labels and funcs, a label instruction has its own label as
+    only label. Names are symbol ids interned in `symbols`, and the values
+    of constants are kept in the side table `consts`.
+    """
+
+    def __init__(self,
+                 name: str,
+                 args: Optional[list[dict[str, str]]] = None,
+                 type: Optional[str] = None,
+                 symbols: Optional[VarIndex] = None):
+        self.name = name
+        self.args = args if args is not None else []
+        self.type = type
+        self.symbols = symbols if symbols is not None else VarIndex()
+        """interned names of the variables, labels and functions
+        """
+        self.ops = array('B')
+        self.types = array('b')
+        self.dests = array('i')
+        self.arg_off = array('i', [0])
+        self.arg_ids = array('i')
+        self.label_off = array('i', [0])
+        self.label_ids = array('i')
+        self.func_off = array('i', [0])
+        self.func_ids = array('i')
+        self.consts: dict[int, Any] = {}
+        """value of each constant instruction
+        """
+
+    def __len__(self) -> int:
+        return len(self.ops)
+
+    def append(self,
+               op: int,
+               dest: int = NONE,
+               tp: int = NONE,
+               args: Iterable[int] = (),
+               labels: Iterable[int] = (),
+               funcs: Iterable[int] = ()) -> int:
+        """Append an instruction of opcode `op`, its names given as symbol ids
+
+        Returns:
+            int: position of the instruction
+        """
+        self.ops.append(op)
+        self.dests.append(dest)
+        self.types.append(tp)
+        self.arg_ids.extend(args)
+        self.arg_off.append(len(self.arg_ids))
+        self.label_ids.extend(labels)
+        self.label_off.append(len(self.label_ids))
+        self.func_ids.extend(funcs)
+        self.func_off.append(len(self.func_ids))
+        return len(self.ops) - 1
+
+    def extend_from(self, other: 'ColumnarFunction', start: int, end: int):
+        """Append instructions `start` to `end` (excluded) of `other`,
+        which shares `symbols` with this function
+        """
+        shift = len(self.ops) - start
+        self.ops.extend(other.ops[start:end])
+        self.dests.extend(other.dests[start:end])
+        self.types.extend(other.types[start:end])
+        for ids, off, other_ids, other_off in ((self.arg_ids, self.arg_off, other.arg_ids, other.arg_off),
+                                               (self.label_ids, self.label_off, other.label_ids, other.label_off),
+                                               (self.func_ids, self.func_off, other.func_ids, other.func_off)):
+            base = len(ids) - other_off[start]
+            ids.extend(other_ids[other_off[start]:other_off[end]])
+            off.extend(o + base for o in other_off[start + 1:end + 1])
+        consts = other.consts
+        for n in range(start, end):
+            if n in consts:
+                self.consts[n + shift] = consts[n]
+
+    def assign(self, other: 'ColumnarFunction'):
+        """Take the instructions of `other`, which shares `symbols` with this function
+        """
+        for column in COLUMNS:
+            setattr(self, column, getattr(other, column))
+
+    @classmethod
+    def from_dict(cls, func: dict[str, Any]) -> 'ColumnarFunction':
+        """Convert a Bril JSON function, checked as `Function` would check it
+        """
+        args = func.get('args', [])
+        if not isinstance(args, list):
+            err = ValueError(f"Invalid args {args} in function {func}")
+            logger.error(err)
+            raise err
+        cf = cls(func.get('name'), [dict(arg) for arg in args], func.get('type'))
+        intern = cf.symbols.intern
+        py_types = tuple(t for t in ValType.all_py_types() if t is not None)
+        for instr in func.get('instrs', []):
+            if 'label' in instr:
+                label = instr['label']
+                if not isinstance(label, str):
+                    err = ValueError(f"Invalid label {label} in {instr}, should be str")
+                    logger.error(err)
+                    raise err
+                cf.append(LABEL, labels=(intern(label),))
+                continue
+            op = OpType.find(instr.get('op'))
+            if op is None:
+                err = ValueError(f"Invalid op {instr.get('op')} in {instr}")
+                logger.error(err)
+                raise err
+            refs = []
+            for key in ('args', 'labels', 'funcs'):
+                names = instr.get(key) or []
+                if not isinstance(names, list):
+                    err = ValueError(f"Invalid {key} {names} in {instr}, should be list")
+                    logger.error(err)
+                    raise err
+                refs.append(map(intern, names))
+            dest = tp = NONE
+            if op == ConstOpType.CONST or op == SsaOpType.PHI or 'dest' in instr:
+                name, val_type = instr.get('dest'), ValType.find(instr.get('type'))
+                if not isinstance(name, str) or val_type is None:
+                    err = ValueError(f"Invalid dest {name} or type {instr.get('type')} in {instr}")
+                    logger.error(err)
+                    raise err
+                dest, tp = intern(name), TYPE_CODES[val_type]
+            elif not op.has_side_effect:
+                err = ValueError(f"Invalid {instr}: op {op} has no side effect")
+                logger.error(err)
+                raise err
+            n = cf.append(OPCODES[op], dest, tp, *refs)
+            if op == ConstOpType.CONST:
+                value = instr.get('value')
+                if not isinstance(value, py_types):
+                    err = ValueError(f"Invalid value {value} in {instr}, should be in {py_types}")
+                    logger.error(err)
+                    raise err
+                cf.consts[n] = value
+        return cf
+
+    @classmethod
+    def from_function(cls, function: Function) -> 'ColumnarFunction':
+        """Convert a `Function` of the object model
+        """
+        cf = cls(function.name, [dict(arg) for arg in function.args], function.type)
+        intern = cf.symbols.intern
+        for i in function.instrs:
+            if isinstance(i, Label):
+                cf.append(LABEL, labels=(intern(i.label),))
+                continue
+            dest = getattr(i, 'dest', None)
+            n = cf.append(OPCODES[i.op],
+                          intern(dest) if dest is not None else NONE,
+                          TYPE_CODES[i.type] if dest is not None else NONE,
+                          map(intern, getattr(i, 'args', None) or ()),
+                          map(intern, getattr(i, 'labels', None) or ()),
+                          map(intern, getattr(i, 'funcs', None) or ()))
+            if i.op == ConstOpType.CONST:
+                cf.consts[n] = i.value
+        return cf
+
+    def instr_dict(self, n: int) -> dict[str, Any]:
+        """Bril JSON of instruction `n`, same as `to_dict` of its `Instruction`
+        """
+        names = self.symbols.names
+        op = self.ops[n]
+        if op == LABEL:
+            return { 'label': names[self.label_ids[self.label_off[n]]] }
+        result: dict[str, Any] = { 'op': OPS[op].value }
+        if self.dests[n] != NONE:
+            result['dest'] = names[self.dests[n]]
+            result['type'] = TYPES[self.types[n]].value
+        if op == CONST:
+            result['value'] = self.consts[n]
+            return result
+        for key, ids, off in (('args', self.arg_ids, self.arg_off),
+                              ('funcs', self.func_ids, self.func_off),
+                              ('labels', self.label_ids, self.label_off)):
+            if off[n] != off[n + 1]:
+                result[key] = [names[s] for s in ids[off[n]:off[n + 1]]]
+        return result
+
+    def to_dict(self) -> dict[str, Any]:
+        result: dict[str, Any] = { 'name': self.name }
+        if self.args:
+            result['args'] = self.args
+        if self.type is not None:
+            result['type'] = self.type
+        result['instrs'] = [self.instr_dict(n) for n in range(len(self))]
+        return result
+
+    def to_function(self) -> Function:
+        """Convert to a `Function` of the object model, parsed on first access
+        """
+        return Function(self.to_dict())
+
+class ColumnarBlock:
+    """Block of a `ColumnarCfg`, instructions `start` to `end` (excluded)
+    of its function, the leading label excluded
+    """
+
+    __slots__ = ('label', 'start', 'end', 'patch', 'target', 'phis')
+
+    def __init__(self, label: str, start: int, end: int):
+        self.label = label
+        self.start = start
+        self.end = end
+        self.patch = NONE
+        """opcode of the terminator appended to the block, `NONE` if it has its own
+        """
+        self.target = NONE
+        """label symbol the appended jump falls through to
+        """
+        self.phis: dict[int, int] = {}
+        """`variable symbol:phi id` map of the phi functions placed in this block
+        """
+
+    def __repr__(self):
+        return f'ColumnarBlock({self.label})'
+
+class ColumnarCfg:
+    """`CFG` of a `ColumnarFunction`, formed the same way, with blocks
+    as instruction ranges and edges between block positions
+
+    Placed phi functions are stored as columns too: phi `p` merges
+    variable `phi_vars[p]` into `phi_dests[p]`, and operand `k` is
+    `operand_values[k]` from `operand_labels[k]` for phi `operand_phis[k]`.
+    """
+
+    def __init__(self, function: ColumnarFunction):
+        self.function = function
+        cf = function
+        names, intern = cf.symbols.names, cf.symbols.intern
+        ops, label_off, label_ids = cf.ops, cf.label_off, cf.label_ids
+        self.label_names = NameGenerator(names[label_ids[label_off[n]]]
+                                         for n in range(len(ops)) if ops[n] == LABEL)
+        """labels taken in this `ColumnarCfg`, to name new blocks
+        """
+        named: dict[str, ColumnarBlock] = {}
+
+        def name_block(begin: int, end: int):
+            if ops[begin] == LABEL:
+                label = names[label_ids[label_off[begin]]]
+                named[label] = ColumnarBlock(label, begin + 1, end)
+            else:
+                label = self.label_names.new_name('b')
+                named[label] = ColumnarBlock(label, begin, end)
+
+        begin = 0
+        for n in range(len(ops)):
+            if ops[n] == LABEL:
+                if n > begin:
+                    name_block(begin, n)
+                begin = n
+            elif ops[n] in TERMINATORS:
+                name_block(begin, n + 1)
+                begin = n + 1
+        if begin < len(ops):
+            name_block(begin, len(ops))
+        self.blocks: list[ColumnarBlock] = list(named.values())
+        """blocks in layout order, the entry block first
+        """
+
+        # a jump to the first block needs a pure entry without in-edge
+        first = cf.symbols.ids.get(self.blocks[0].label)
+        if first is not None and any(ops[n] != LABEL and first in label_ids[label_off[n]:label_off[n + 1]]
+                                     for n in range(len(ops)) if label_off[n] != label_off[n + 1]):
+            self.blocks.insert(0, ColumnarBlock(self.label_names.new_name('fresh'), 0, 0))
+
+        position = { bb.label: n for n, bb in enumerate(self.blocks) }
+        self.succs: list[list[int]] = []
+        """sorted successor positions of each block
+        """
+        for n, bb in enumerate(self.blocks):
+            last = bb.end - 1
+            if bb.end == bb.start or ops[last] not in TERMINATORS:
+                if n == len(self.blocks) - 1:
+                    bb.patch = RET
+                    self.succs.append([])
+                else:
+                    bb.patch, bb.target = JMP, intern(self.blocks[n + 1].label)
+                    self.succs.append([n + 1])
+                continue
+            labels = label_ids[label_off[last]:label_off[last + 1]]
+            if cf.dests[last] != NONE or (ops[last] in (JMP, BR) and len(labels) == 0):
+                err = ValueError(f"Invalid last instruction {cf.instr_dict(last)} in {bb}")
+                logger.error(err)
+                raise err
+            self.succs.append(sorted(set(position[names[l]] for l in labels))
+                              if ops[last] != RET else [])
+
+        self.phi_vars = array('i')
+        self.phi_dests = array('i')
+        self.phi_types = array('b')
+        self.operand_phis = array('i')
+        self.operand_labels = array('i')
+        self.operand_values = array('i')
+        self._index: Optional[ColumnarCfgIndex] = None
+
+    @property
+    def index(self) -> 'ColumnarCfgIndex':
+        """Frozen, index based view of this `ColumnarCfg`, built on first access
+        """
+        if self._index is None:
+            self._index = ColumnarCfgIndex(self)
+        return self._index
+
+    def invalidate_index(self):
+        self._index = None
+
+    def insert_phi_if_not_exist_for(self, bb: ColumnarBlock, var: int, tp: int) -> bool:
+        """Place an empty phi function for variable symbol `var` in `bb` unless there is one already
+
+        Returns:
+            bool: whether a new phi function is inserted
+        """
+        if var in bb.phis:
+            return False
+        bb.phis[var] = len(self.phi_vars)
+        self.phi_vars.append(var)
+        self.phi_dests.append(var)
+        self.phi_types.append(tp)
+        return True
+
+    def add_operand(self, phi: int, label: int, value: int):
+        self.operand_phis.append(phi)
+        self.operand_labels.append(label)
+        self.operand_values.append(value)
+
+class ColumnarCfgIndex(CfgIndex):
+    """`CfgIndex` of a `ColumnarCfg`, its `blocks` are `ColumnarBlock`s
+    """
+
+    def __init__(self, cfg: ColumnarCfg):
+        self.cfg = cfg
+        self._number(cfg.blocks, cfg.succs, 0)
+
+class ColumnarLiveness(Liveness):
+    """Pre-SSA `Liveness` of a `ColumnarCfg`
+    """
+
+    def _scan(self, bb: ColumnarBlock, phi_defs: list[str], phi_uses: list[list[str]]) -> tuple[set[str], set[str]]:
+        cf = self.cfg.function
+        names, ops, dests, arg_off, arg_ids = cf.symbols.names, cf.ops, cf.dests, cf.arg_off, cf.arg_ids
+        uses: set[str] = set()
+        defs: set[str] = set()
+        for n in range(bb.start, bb.end):
+            if ops[n] == PHI:
+                continue
+            uses.update(names[a] for a in arg_ids[arg_off[n]:arg_off[n + 1]] if names[a] not in defs)
+            if dests[n] != NONE:
+                defs.add(names[dests[n]])
+        return uses, defs
+
+def collect_definitions(cfg: ColumnarCfg) -> tuple[dict[int, tuple[int, int]], set[int]]:
+    """Collect definitions like `ssa_construct.collect_definitions`, over symbols
+
+    Returns:
+        `(defs, global_names)`
+
+        defs (dict[int, tuple[int, int]]): bitset over `cfg.index` of
+            the blocks defining each variable, and its type code
+        global_names (set[int]): variables used in some block before defined in it
+    """
+    cf = cfg.function
+    ops, dests, types, arg_off, arg_ids = cf.ops, cf.dests, cf.types, cf.arg_off, cf.arg_ids
+    label2idx = cfg.index.label2idx
+    defs: dict[int, tuple[int, int]] = {}
+    global_names: set[int] = set()
+    for bb in cfg.blocks:
+        bit = 1 << label2idx[bb.label]
+        kill: set[int] = set()
+        for n in range(bb.start, bb.end):
+            global_names.update(a for a in arg_ids[arg_off[n]:arg_off[n + 1]] if a not in kill)
+            dest = dests[n]
+            if dest != NONE:
+                kill.add(dest)
+                bits, tp = defs.get(dest, (0, types[n]))
+                defs[dest] = (bits | bit, tp)
+    return defs, global_names
+
+def insert_phi_functions(cfg: ColumnarCfg,
+                         dom_tree: DominatorTree,
+                         defs: dict[int, tuple[int, int]],
+                         live: Optional[Liveness] = None) -> int:
+    """Place phi functions at the iterated dominance frontier of the blocks defining each variable
+
+    Args:
+        live (Liveness, optional): pre-SSA liveness of the function,
+            if given, phis are only placed where the variable is live on entry
+
+    Returns:
+        int: number of phi functions inserted
+    """
+    blocks, names = cfg.index.blocks, cfg.function.symbols.names
+    n_phis = 0
+    for var, (bits, tp) in defs.items():
+        for b in iter_bits(dom_tree.iterated_frontier_bits(bits)):
+            if live is not None and not live.is_live_in(names[var], b):
+                continue
+            if cfg.insert_phi_if_not_exist_for(blocks[b], var, tp):
+                n_phis += 1
+    return n_phis
+
+def rename_variables(cfg: ColumnarCfg, dom_tree: DominatorTree, defs: dict[int, tuple[int, int]]):
+    """Rename variables as `ssa_construct.rename_variables`,
+    rewriting the dests and args of the instructions in place
+    """
+    cf = cfg.function
+    names, intern = cf.symbols.names, cf.symbols.intern
+    ops, dests, arg_off, arg_ids = cf.ops, cf.dests, cf.arg_off, cf.arg_ids
+    new_names = NameGenerator(names[var] for var in defs)
+    for arg in cf.args:
+        new_names.take(arg['name'])
+    rename_stacks: dict[int, list[int]] = {}
+
+    def rename(var: int, pushed: list[int]) -> int:
+        renamed_var = intern(new_names.new_name(f"{names[var]}.", 0))
+        rename_stacks.setdefault(var, []).append(renamed_var)
+        pushed.append(var)
+        return renamed_var
+
+    for arg in cf.args:
+        arg['name'] = names[rename(intern(arg['name']), [])]
+    blocks = dom_tree.index.blocks
+    undo_logs: list[list[int]] = []
+    for b, entering in dom_tree.walk():
+        if not entering:
+            for var in reversed(undo_logs.pop()):
+                rename_stacks[var].pop()
+            continue
+        bb = blocks[b]
+        pushed: list[int] = []
+        for var in sorted(bb.phis, key=names.__getitem__):
+            cfg.phi_dests[bb.phis[var]] = rename(var, pushed)
+        for n in range(bb.start, bb.end):
+            if ops[n] == PHI:
+                continue
+            for k in range(arg_off[n], arg_off[n + 1]):
+                stack = rename_stacks.get(arg_ids[k])
+                if stack:
+                    arg_ids[k] = stack[-1]
+            if dests[n] != NONE:
+                dests[n] = rename(dests[n], pushed)
+        label = intern(bb.label)
+        for s in dom_tree.index.succs(b):
+            for var, phi in blocks[s].phis.items():
+                stack = rename_stacks.get(var)
+                value = stack[-1] if stack else intern(f"{names[var]}.{NullityType.UNDEFINED.name}")
+                cfg.add_operand(phi, label, value)
+        undo_logs.append(pushed)
+
+def reconstruct_instructions(cfg: ColumnarCfg) -> ColumnarFunction:
+    """Lay the blocks of `cfg` out as a function again, each with its label,
+    its phi functions ordered by variable, its body and terminator
+    """
+    cf = cfg.function
+    names, intern = cf.symbols.names, cf.symbols.intern
+    # group the operands by phi, in the order they were added
+    n_phis = len(cfg.phi_vars)
+    off = [0] * (n_phis + 1)
+    for p in cfg.operand_phis:
+        off[p + 1] += 1
+    for p in range(n_phis):
+        off[p + 1] += off[p]
+    fill = off[:-1]
+    labels = array('i', [0]) * len(cfg.operand_phis)
+    values = array('i', labels)
+    for p, label, value in zip(cfg.operand_phis, cfg.operand_labels, cfg.operand_values):
+        labels[fill[p]], values[fill[p]] = label, value
+        fill[p] += 1
+
+    result = ColumnarFunction(cf.name, cf.args, cf.type, cf.symbols)
+    for bb in cfg.blocks:
+        result.append(LABEL, labels=(intern(bb.label),))
+        for var in sorted(bb.phis, key=names.__getitem__):
+            p = bb.phis[var]
+            result.append(PHI, cfg.phi_dests[p], cfg.phi_types[p],
+                          values[off[p]:off[p + 1]], labels[off[p]:off[p + 1]])
+        result.extend_from(cf, bb.start, bb.end)
+        if bb.patch == JMP:
+            result.append(JMP, labels=(bb.target,))
+        elif bb.patch == RET:
+            result.append(RET)
+    return result
+
+def construct_ssa(function: ColumnarFunction, mode: str = 'minimal') -> int:
+    """
+    Transforms the columnar function into SSA form, as `ssa_construct.construct_ssa`
+    without removing trivial phis.
+
+    Args:
+        mode (str, optional): phi placement mode in `ssa_construct.SSA_MODES`. Defaults to `minimal`.
+
+    Returns:
+        int: number of phi functions inserted
+    """
+    if mode not in SSA_MODES:
+        err = ValueError(f"Invalid SSA mode {mode}, should be one of {SSA_MODES}")
+        logger.error(err)
+        raise err
+    cfg = ColumnarCfg(function)
+    dom_tree = DominatorTree(cfg)
+    defs, global_names = collect_definitions(cfg)
+    global_defs = defs if mode == 'minimal' else { var: v for var, v in defs.items() if var in global_names }
+    live = ColumnarLiveness(cfg) if mode == 'pruned' else None
+    n_phis = insert_phi_functions(cfg, dom_tree, global_defs, live)
+    rename_variables(cfg, dom_tree, defs)
+    function.assign(reconstruct_instructions(cfg))
+    return n_phis
@@ -0,0 +1,90 @@
+from typing import Callable, Optional
+from cfg import CfgIndex
+
+class Dataflow:
+    """Worklist solver of a dataflow problem over the blocks of a `CfgIndex`,
+    lattice values are int bitsets
+
+    A forward problem flows along the edges, a backward one against them.
+    Each block takes the `meet` of the values flowing into it from its
+    neighbours (`boundary` if it has none) and passes it through `transfer`.
+    The worklist always takes the pending block earliest in the visiting order,
+    reverse postorder for forward problems and postorder for backward ones.
+    """
+
+    def __init__(self,
+                 index: CfgIndex,
+                 forward: bool,
+                 meet: Callable[[int, int], int],
+                 transfer: Callable[[int, int], int],
+                 top: int,
+                 boundary: int,
+                 edge: Optional[Callable[[int, int, int], int]] = None,
+                 n_blocks: Optional[int] = None):
+        """Solve a dataflow problem
+
+        Args:
+            index (CfgIndex): blocks and edges, numbered in reverse postorder
+            forward (bool): whether values flow from predecessors to successors
+            meet (Callable[[int, int], int]): combines two incoming values, e.g. `operator.or_`
+            transfer (Callable[[int, int], int]): `(b, incoming value) -> outgoing value`
+            top (int): initial outgoing value of every block, the identity of `meet`
+            boundary (int): incoming value of blocks without neighbours to meet
+            edge (Callable[[int, int, int], int], optional): `(from, to, value) -> value`
+                applied to a value flowing along an edge. Defaults to identity.
+            n_blocks (int, optional): only solve block indices below it, ignoring
+                edges from blocks beyond. Defaults to all blocks.
+        """
+        self.index = index
+        self.forward = forward
+        n = len(index) if n_blocks is None else n_blocks
+        self.n_blocks = n
+        self.ins = [boundary] * n
+        """value flowing into the transfer of each block,
+        i.e. at its entry for forward problems and at its exit for backward ones
+        """
+        self.outs = [top] * n
+        """value leaving the transfer of each block
+        """
+        self.visits = 0
+        """number of blocks the worklist has processed
+        """
+        self.changes = 0
+        """number of visits that changed the outgoing value
+        """
+        self._solve(meet, transfer, boundary, edge)
+
+    def _solve(self,
+               meet: Callable[[int, int], int],
+               transfer: Callable[[int, int], int],
+               boundary: int,
+               edge: Optional[Callable[[int, int, int], int]]):
+        n = self.n_blocks
+        index = self.index
+        if self.forward:
+            sources, targets = index.preds, index.succs
+        else:
+            sources, targets = index.succs, index.preds
+        ins, outs = self.ins, self.outs
+        pending = (1 << n) - 1
+        while pending:
+            if self.forward:  # earliest in reverse postorder
+                b = (pending & -pending).bit_length() - 1
+            else:  # earliest in postorder
+                b = pending.bit_length() - 1
+            pending ^= 1 << b
+            self.visits += 1
+            value = None
+            for s in sources(b):
+                if s >= n:
+                    continue
+                incoming = outs[s] if edge is None else edge(s, b, outs[s])
+                value = incoming if value is None else meet(value, incoming)
+            ins[b] = boundary if value is None else value
+            out = transfer(b, ins[b])
+            if out != outs[b]:
+                outs[b] = out
+                self.changes += 1
+                for t in targets(b):
+                    if t < n:
+                        pending |= 1 << t
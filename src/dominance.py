@@ -1,35 +1,36 @@
+from bisect import insort
 from collections import deque
-from functools import reduce
-from typing import Optional
-from cfg import CFG, BasicBlock
+from heapq import heappop, heappush
+from typing import Callable, Iterable, Iterator, Optional
+from operator import and_
+from cfg import CFG, BasicBlock, BlockSet, CfgIndex, EditableCfgIndex
+from dataflow import Dataflow
 from logger.logger import logger
-from util import Convertor
+from util import Convertor, bits_of, iter_bits
 
 class Cfg2Dom(Convertor):
     @classmethod
-    def convert(cls, cfg: CFG) -> dict[BasicBlock, set[BasicBlock]]:
+    def dom_of(cls, index: CfgIndex) -> list[int]:
+        """Dominator set of each block index as a bitset over block indices
+
+        Solved as a forward dataflow problem, `dom(b) = {b} | meet(dom(p) for p in preds(b))`.
+        Unreachable blocks are only dominated by themselves.
+        """
+        n = index.n_reachable
+        flow = Dataflow(index, True, and_, lambda b, dom: dom | (1 << b),
+                        top=(1 << n) - 1, boundary=0, n_blocks=n)
+        return flow.outs + [1 << b for b in range(n, len(index))]
+
+    @classmethod
+    def convert(cls, cfg: CFG) -> dict[BasicBlock, BlockSet]:
         """Convert cfg to Dominance: dict in format `BasicBlock : set of BasicBlock` pair
 
         Computes the dominators for each basic block.
         """
         # TODO: Implement the iterative algorithm to compute dominators.
-        full_set = lambda: set(cfg.blocks.values())
-        dom = { bb: full_set() for bb in cfg.blocks.values() }
-        while True:
-            changed = False
-            for bb in cfg.blocks.values():
-                nxt_dom = { bb }
-                if len(bb.preds) > 0:
-                    nxt_dom.update(reduce(lambda s1, s2: s1.intersection(s2),
-                                          list(dom.get(pred) for pred in bb.preds)))
-
-                if dom[bb] != nxt_dom:
-                    dom[bb] = nxt_dom
-                    changed = True
-                
-            if not changed:
-                break
-        return dom
+        index = cfg.index
+        return { bb: index.block_set(bits)
+                 for bb, bits in zip(index.blocks, cls.dom_of(index)) }
 
 class Dom2Idom(Convertor):
     @classmethod
@@ -48,24 +49,216 @@ class Dom2Idom(Convertor):
                 idom[bb] = max(candidates.items(), key=lambda e: e[1])[0]
         return idom
 
-class Idom2Df(Convertor):
+def idom2dict(index: CfgIndex, idom: list[int]) -> dict[BasicBlock, Optional[BasicBlock]]:
+    """Map an index based immediate dominator array (`-1` for none) back to blocks
+    """
+    return { bb: (None if d == -1 else index.blocks[d])
+             for bb, d in zip(index.blocks, idom) }
+
+class Cfg2Idom(Convertor):
     @classmethod
-    def convert(cls, idom: dict[BasicBlock, Optional[BasicBlock]]):
+    def _intersect(cls, idom: list[int], b1: int, b2: int) -> int:
+        """Walk up from `b1` and `b2` to their nearest common dominator,
+        blocks are numbered in reverse postorder
         """
-        Computes the dominance frontiers for each basic block.
+        while b1 != b2:
+            while b1 > b2:
+                b1 = idom[b1]
+            while b2 > b1:
+                b2 = idom[b2]
+        return b1
+
+    @classmethod
+    def idom_of(cls, index: CfgIndex) -> list[int]:
+        """Immediate dominator of each block index, `-1` for the entry
+        and unreachable blocks
         """
-        # TODO: Implement dominance frontier computation.
-        df: dict[BasicBlock, set[BasicBlock]] = {
-            bb: set() for bb in idom.keys() }
+        n = index.n_reachable
+        # only reachable predecessors take part in the intersection
+        preds = [[p for p in index.preds(b) if p < n] for b in range(n)]
+        idom = [-1] * len(index)
+        idom[0] = 0
+        changed = True
+        while changed:
+            changed = False
+            for b in range(1, n):
+                new_idom = -1
+                for p in preds[b]:
+                    if idom[p] == -1:  # not processed yet
+                        continue
+                    new_idom = p if new_idom == -1 else cls._intersect(idom, p, new_idom)
+                if idom[b] != new_idom:
+                    idom[b] = new_idom
+                    changed = True
+        idom[0] = -1
+        return idom
+
+    @classmethod
+    def convert(cls, cfg: CFG) -> dict[BasicBlock, Optional[BasicBlock]]:
+        """Convert cfg to immediate dominators directly, without building
+        dominator sets (Cooper, Harvey and Kennedy, "A Simple, Fast Dominance Algorithm")
+
+        Blocks unreachable from the entry block have no immediate dominator.
+        """
+        return idom2dict(cfg.index, cls.idom_of(cfg.index))
+
+class Cfg2IdomSemiNca(Convertor):
+    @classmethod
+    def _eval(cls, v: int, ancestor: list[int], label: list[int], semi: list[int]) -> int:
+        """Minimum-semidominator vertex on the forest path above `v`,
+        with iterative path compression
+        """
+        if ancestor[v] == -1:
+            return v
+        path = []
+        x = v
+        while ancestor[ancestor[x]] != -1:
+            path.append(x)
+            x = ancestor[x]
+        while len(path) > 0:
+            x = path.pop()
+            a = ancestor[x]
+            if semi[label[a]] < semi[label[x]]:
+                label[x] = label[a]
+            ancestor[x] = ancestor[a]
+        return label[v]
+
+    @classmethod
+    def idom_from(cls,
+                  index: CfgIndex,
+                  root: int,
+                  allowed: Optional[Callable[[int], bool]] = None) -> tuple[list[int], list[int]]:
+        """Immediate dominators of the blocks reachable from `root`,
+        only walking through blocks for which `allowed` holds
+
+        Returns:
+            tuple[list[int], list[int]]: `(order, idom)`, blocks reached in
+                preorder and the immediate dominator of each, `-1` for `root`
+        """
+        # iterative DFS, number blocks in preorder and record tree parents
+        order = [root]
+        num = { root: 0 }
+        parent = [-1]
+        stack = [(0, iter(index.succs(root)))]
+        while len(stack) > 0:
+            v, succs = stack[-1]
+            for s in succs:
+                if s not in num and (allowed is None or allowed(s)):
+                    num[s] = len(order)
+                    order.append(s)
+                    parent.append(v)
+                    stack.append((num[s], iter(index.succs(s))))
+                    break
+            else:
+                stack.pop()
+
+        n = len(order)
+        semi = list(range(n))
+        label = list(range(n))
+        ancestor = [-1] * n
+        for w in range(n - 1, 0, -1):
+            for p in index.preds(order[w]):
+                if p not in num:  # predecessor not reached
+                    continue
+                u = cls._eval(num[p], ancestor, label, semi)
+                if semi[u] < semi[w]:
+                    semi[w] = semi[u]
+            ancestor[w] = parent[w]  # link
+
+        dfs_idom = list(parent)
+        for w in range(1, n):
+            while dfs_idom[w] > semi[w]:
+                dfs_idom[w] = dfs_idom[dfs_idom[w]]
+        return order, [-1] + [order[dfs_idom[w]] for w in range(1, n)]
+
+    @classmethod
+    def idom_of(cls, index: CfgIndex) -> list[int]:
+        """Immediate dominator of each block index, `-1` for the entry
+        and unreachable blocks
+        """
+        idom = [-1] * len(index)
+        for b, d in zip(*cls.idom_from(index, 0)):
+            idom[b] = d
+        return idom
+
+    @classmethod
+    def convert(cls, cfg: CFG) -> dict[BasicBlock, Optional[BasicBlock]]:
+        """Convert cfg to immediate dominators with the semi-NCA variant of
+        Lengauer-Tarjan (Georgiadis, "Linear-Time Algorithms for Dominators and Related Problems")
+
+        Semidominators are computed in a single reverse preorder pass,
+        then immediate dominators are the nearest common ancestors
+        in the DFS tree. Blocks unreachable from the entry block have
+        no immediate dominator.
+        """
+        return idom2dict(cfg.index, cls.idom_of(cfg.index))
+
+class Idom2Dom(Convertor):
+    @classmethod
+    def convert(cls,
+                idom: dict[BasicBlock, Optional[BasicBlock]]) -> dict[BasicBlock, set[BasicBlock]]:
+        """
+        Derives the dominator set of each basic block from the immediate dominators.
+        """
+        dom: dict[BasicBlock, set[BasicBlock]] = {}
         for bb in idom.keys():
-            if len(bb.preds) > 1:
-                for pred in bb.preds:
-                    cur = pred
-                    while cur != idom[bb]:
-                        df[cur].add(bb)
+            # collect the chain up to an already solved dominator
+            chain = []
+            cur = bb
+            while cur is not None and cur not in dom:
+                chain.append(cur)
+                cur = idom[cur]
+            for b in reversed(chain):
+                dom[b] = { b } if cur is None else dom[cur] | { b }
+                cur = b
+        return dom
+
+    @classmethod
+    def dom_of(cls, children: list[list[int]], root: int = 0) -> list[int]:
+        """Dominator set of each block index as a bitset, from the dominator tree `children`
+        """
+        dom = [1 << b for b in range(len(children))]
+        stack = [root]
+        while len(stack) > 0:
+            d = stack.pop()
+            for c in children[d]:
+                dom[c] |= dom[d]
+                stack.append(c)
+        return dom
+
+class Idom2Df(Convertor):
+    @classmethod
+    def _frontier_bits(cls, preds: list[list[int]], idom: list[int]) -> list[int]:
+        df = [0] * len(idom)
+        for b, b_preds in enumerate(preds):
+            if len(b_preds) > 1:
+                bit = 1 << b
+                for p in b_preds:
+                    cur = p
+                    while cur != -1 and cur != idom[b]:
+                        df[cur] |= bit
                         cur = idom[cur]
         return df
 
+    @classmethod
+    def convert(cls, idom: dict[BasicBlock, Optional[BasicBlock]]) -> dict[BasicBlock, BlockSet]:
+        """
+        Computes the dominance frontiers for each basic block.
+        """
+        # TODO: Implement dominance frontier computation.
+        blocks = list(idom.keys())
+        label2idx = { bb.label: i for i, bb in enumerate(blocks) }
+        idom_idx = [-1 if d is None else label2idx[d.label] for d in idom.values()]
+        preds = [[label2idx[p.label] for p in bb.preds] for bb in blocks]
+        df = cls._frontier_bits(preds, idom_idx)
+        return { bb: BlockSet(blocks, label2idx, bits) for bb, bits in zip(blocks, df) }
+
+    @classmethod
+    def frontiers_of(cls, index: CfgIndex, idom: list[int]) -> list[int]:
+        """Dominance frontier of each block index as a bitset, see `convert`
+        """
+        return cls._frontier_bits([index.preds(b) for b in range(len(index))], idom)
+
 class Idom2DomTree(Convertor):
     @classmethod
     def convert(cls, idom: dict[BasicBlock, Optional[BasicBlock]]):
@@ -75,12 +268,674 @@ class Idom2DomTree(Convertor):
                 dom_links.setdefault(_idom.label, []).append(bb)
         return { k: sorted(v, key=lambda bb: bb.label) for k, v in dom_links.items() }
 
+    @classmethod
+    def children_of(cls, index: CfgIndex, idom: list[int]) -> list[list[int]]:
+        """Children of each block index in the dominator tree, sorted by label as `convert`
+        """
+        children: list[list[int]] = [[] for _ in range(len(index))]
+        for b, d in enumerate(idom):
+            if d != -1:
+                children[d].append(b)
+        for c in children:
+            c.sort(key=lambda b: index.blocks[b].label)
+        return children
+
+class Cfg2IdomBySets(Convertor):
+    @classmethod
+    def convert(cls, cfg: CFG) -> dict[BasicBlock, Optional[BasicBlock]]:
+        """Convert cfg to immediate dominators through full dominator sets
+        """
+        return Dom2Idom.convert(Cfg2Dom.convert(cfg))
+
+    @classmethod
+    def idom_of(cls, index: CfgIndex) -> list[int]:
+        # strict dominators of a block form a chain ordered by reverse postorder,
+        # the immediate one is the last, i.e. the highest bit
+        return [(bits & ~(1 << b)).bit_length() - 1
+                for b, bits in enumerate(Cfg2Dom.dom_of(index))]
+
+IDF_ENGINES = ('merge', 'dj', 'df')
+"""engines of `DominatorTree.iterated_frontier_bits`
+"""
+
+DOM_BACKENDS: dict[str, type[Convertor]] = {
+    'sets': Cfg2IdomBySets,
+    'chk': Cfg2Idom,
+    'semi-nca': Cfg2IdomSemiNca,
+}
+"""name: immediate dominator convertor of a cfg,
+each provides `idom_of(index: CfgIndex) -> list[int]`
+"""
+
+SEMI_NCA_MIN_BLOCKS = 256
+"""`auto` backend uses semi-NCA from this number of blocks on
+"""
+
+def select_dom_backend(index: CfgIndex) -> str:
+    """Pick a dominator backend by block and edge count
+
+    The iterative engine wins on small functions, while semi-NCA does
+    a single pass no matter how many iterations the CFG would take,
+    so it is used for large or densely connected (often irreducible) CFGs.
+    """
+    n_blocks = len(index)
+    if n_blocks >= SEMI_NCA_MIN_BLOCKS or index.n_edges() > 2 * n_blocks:
+        return 'semi-nca'
+    return 'chk'
+
+def cross_check_idom(index: CfgIndex) -> list[int]:
+    """Run every backend in `DOM_BACKENDS` and assert they agree
+
+    Returns:
+        list[int]: the agreed immediate dominator of each block index
+    """
+    results = { name: backend.idom_of(index) for name, backend in DOM_BACKENDS.items() }
+    golden_name, golden = next(iter(results.items()))
+    for name, idom in results.items():
+        if idom != golden:
+            diff = [index.blocks[b] for b in range(len(index)) if golden[b] != idom[b]]
+            err = ValueError(f"Dominator backends {golden_name} and {name} disagree on {diff}")
+            logger.error(err)
+            raise err
+    return golden
+
+class DomTreeNumbering:
+    """DFS interval numbering and LCA table of a dominator tree
+
+    `a` dominates `b` iff the `[pre, post]` interval of `a` encloses the one of `b`.
+    The nearest common dominator is the shallowest block between the first
+    visits of two blocks in the Euler tour, answered by a sparse table in O(1).
+    """
+
+    def __init__(self, children: list[list[int]], root: int = 0):
+        n = len(children)
+        self.pre = [-1] * n
+        """preorder number of each block index, `-1` if not in the tree
+        """
+        self.post = [-1] * n
+        """postorder number of each block index, `-1` if not in the tree
+        """
+        self.depth = [0] * n
+        """depth of each block index in the tree
+        """
+        self.first = [-1] * n
+        """position of the first visit of each block index in `euler`
+        """
+        self.euler: list[int] = [root]
+        """Euler tour of the tree
+        """
+        n_pre, n_post = 1, 0
+        self.pre[root] = 0
+        self.first[root] = 0
+        stack = [(root, iter(children[root]))]
+        while len(stack) > 0:
+            v, it = stack[-1]
+            for c in it:
+                self.pre[c] = n_pre
+                n_pre += 1
+                self.depth[c] = self.depth[v] + 1
+                self.first[c] = len(self.euler)
+                self.euler.append(c)
+                stack.append((c, iter(children[c])))
+                break
+            else:
+                stack.pop()
+                self.post[v] = n_post
+                n_post += 1
+                if len(stack) > 0:
+                    self.euler.append(stack[-1][0])
+
+        # sparse[k][i]: shallowest block in euler[i:i + 2 ** k]
+        depth = self.depth
+        self.sparse = [self.euler]
+        k = 1
+        while (1 << k) <= len(self.euler):
+            prev = self.sparse[-1]
+            half = 1 << (k - 1)
+            self.sparse.append([x if depth[x] <= depth[y] else y
+                                for x, y in zip(prev, prev[half:])])
+            k += 1
+
+    def in_tree(self, b: int) -> bool:
+        return self.pre[b] != -1
+
+    def dominates(self, a: int, b: int) -> bool:
+        return (self.pre[a] <= self.pre[b]
+                and self.post[b] <= self.post[a]
+                and self.pre[b] != -1)
+
+    def nca(self, a: int, b: int) -> int:
+        """Nearest common ancestor of two blocks in the tree
+        """
+        l, r = self.first[a], self.first[b]
+        if l > r:
+            l, r = r, l
+        k = (r - l + 1).bit_length() - 1
+        x, y = self.sparse[k][l], self.sparse[k][r - (1 << k) + 1]
+        return x if self.depth[x] <= self.depth[y] else y
+
 class DominatorTree:
-    def __init__(self, cfg: CFG):
+    def __init__(self, cfg: CFG, backend: str = 'auto'):
+        """
+        Args:
+            cfg (CFG): control flow graph to analyze
+            backend (str, optional): one of `DOM_BACKENDS`, `auto` to pick
+                by `select_dom_backend`, or `cross-check` to run all of them
+                and assert they agree. Defaults to `auto`.
+        """
         self.cfg = cfg
-        self.dom = Cfg2Dom.convert(self.cfg)
-        self.idom = Dom2Idom.convert(self.dom)
-        self.dom_frontiers = Idom2Df.convert(self.idom)
-        self.children = Idom2DomTree.convert(self.idom)
+        self.index = cfg.index
+        """index view of `cfg` the `*_idx` members refer to
+        """
+        if backend == 'auto':
+            backend = select_dom_backend(self.index)
+        if backend == 'cross-check':
+            idom_idx = cross_check_idom(self.index)
+        elif backend in DOM_BACKENDS:
+            idom_idx = DOM_BACKENDS[backend].idom_of(self.index)
+        else:
+            err = ValueError(f"Invalid dominator backend {backend}, should be in {[*DOM_BACKENDS, 'auto', 'cross-check']}")
+            logger.error(err)
+            raise err
+        self.backend = backend
+        self.idom_idx = idom_idx
+        """immediate dominator of each block index, `-1` for none
+        """
+        self.idom = idom2dict(self.index, self.idom_idx)
+        self.children_idx = Idom2DomTree.children_of(self.index, self.idom_idx)
+        """children of each block index in this Dominator tree
+        """
+        blocks = self.index.blocks
+        self.children = { blocks[b].label: [blocks[c] for c in children]
+                          for b, children in enumerate(self.children_idx)
+                          if len(children) > 0 }
         """blocks under block `(subscripting bb)` in this Dominator tree
         """
+        self._invalidate()
+        self._depth: Optional[list[int]] = None
+        self._moved: set[int] = set()
+        """blocks whose immediate dominator or children changed in the current edit
+        """
+
+    def _invalidate(self):
+        """Drop analyses derived from the tree, they are rebuilt on next access
+        """
+        self._dom_bits: Optional[list[int]] = None
+        self._dom: Optional[dict[BasicBlock, BlockSet]] = None
+        self._frontier_bits: Optional[list[int]] = None
+        self._merge_bits: Optional[list[int]] = None
+        self._dom_frontiers: Optional[dict[BasicBlock, BlockSet]] = None
+        self._numbering: Optional[DomTreeNumbering] = None
+
+    @property
+    def frontier_bits(self) -> list[int]:
+        """dominance frontier of each block index as a bitset
+        """
+        if self._frontier_bits is None:
+            self._frontier_bits = Idom2Df.frontiers_of(self.index, self.idom_idx)
+        return self._frontier_bits
+
+    @property
+    def dom_frontiers(self) -> dict[BasicBlock, BlockSet]:
+        """dominance frontier of each block
+        """
+        if self._dom_frontiers is None:
+            self._dom_frontiers = { bb: self.index.block_set(bits)
+                                    for bb, bits in zip(self.index.blocks, self.frontier_bits) }
+        return self._dom_frontiers
+
+    @property
+    def dom_bits(self) -> list[int]:
+        """dominator set of each block index as a bitset, derived from `children_idx` on first access
+        """
+        if self._dom_bits is None:
+            self._dom_bits = Idom2Dom.dom_of(self.children_idx)
+        return self._dom_bits
+
+    @property
+    def dom(self) -> dict[BasicBlock, BlockSet]:
+        """dominator sets of each block, derived from `idom` on first access
+        """
+        if self._dom is None:
+            self._dom = { bb: self.index.block_set(bits)
+                          for bb, bits in zip(self.index.blocks, self.dom_bits) }
+        return self._dom
+
+    @property
+    def merge_bits(self) -> list[int]:
+        """merge set of each block index as a bitset, i.e. its iterated
+        dominance frontier, computed on first access
+
+        `M(n) = DF(n) | M(t) for t in DF(n)`, solved with a worklist
+        that revisits the blocks whose frontier contains a changed block.
+        """
+        if self._merge_bits is None:
+            df = self.frontier_bits
+            merge = list(df)
+            in_df_of: list[list[int]] = [[] for _ in df]
+            for n, bits in enumerate(df):
+                for t in iter_bits(bits):
+                    in_df_of[t].append(n)
+            work = [n for n in range(len(df)) if df[n] != 0]
+            pending = set(work)
+            while len(work) > 0:
+                n = work.pop()
+                pending.discard(n)
+                new = merge[n]
+                for t in iter_bits(df[n]):
+                    new |= merge[t]
+                if new != merge[n]:
+                    merge[n] = new
+                    for m in in_df_of[n]:
+                        if m not in pending:
+                            pending.add(m)
+                            work.append(m)
+            self._merge_bits = merge
+        return self._merge_bits
+
+    def iterated_frontier_bits(self, bits: int, engine: str = 'merge') -> int:
+        """Iterated dominance frontier of the blocks in bitset `bits`, as a bitset
+
+        Args:
+            bits (int): bitset of (definition) blocks
+            engine (str, optional): one of `IDF_ENGINES`. `merge` unions the
+                precomputed merge sets, one `|` per block in `bits`.
+                `dj` walks the DJ-graph, linear per query without precomputation.
+                `df` closes over the dominance frontiers. Defaults to `merge`.
+        """
+        if engine == 'merge':
+            idf = 0
+            merge_bits = self.merge_bits
+            for b in iter_bits(bits):
+                idf |= merge_bits[b]
+            return idf
+        elif engine == 'dj':
+            return self._dj_iterated_frontier_bits(bits)
+        elif engine == 'df':
+            return self._df_iterated_frontier_bits(bits)
+        err = ValueError(f"Invalid iterated frontier engine {engine}, should be in {IDF_ENGINES}")
+        logger.error(err)
+        raise err
+
+    def _df_iterated_frontier_bits(self, bits: int) -> int:
+        idf = 0
+        work = bits
+        while work:
+            low = work & -work
+            work ^= low
+            new = self.frontier_bits[low.bit_length() - 1] & ~idf
+            idf |= new
+            work |= new
+        return idf
+
+    def _dj_iterated_frontier_bits(self, bits: int) -> int:
+        """Sreedhar and Gao's piggybank algorithm over the DJ-graph
+        (dominator tree edges plus the CFG join edges)
+
+        Definition blocks are taken from the deepest level up. From each root
+        the dominator subtree is walked once, and every join edge to a block
+        not deeper than the root adds its target to the frontier.
+        Each block is walked once per query.
+        """
+        index, depth, children = self.index, self.numbering.depth, self.children_idx
+        defs = set(iter_bits(bits))
+        idf: set[int] = set()
+        visited: set[int] = set()
+        heap: list[tuple[int, int]] = []
+        unreachable: list[int] = []
+        for b in defs:
+            if self._reachable(b):
+                heappush(heap, (-depth[b], b))
+            else:
+                unreachable.append(b)
+
+        # unreachable blocks have no subtree, their frontier is their join successors
+        for b in unreachable:
+            for s in index.succs(b):
+                if len(index.preds(s)) > 1 and s not in idf:
+                    idf.add(s)
+                    if s not in defs:
+                        if self._reachable(s):
+                            heappush(heap, (-depth[s], s))
+                        else:
+                            unreachable.append(s)
+
+        while len(heap) > 0:
+            _, root = heappop(heap)
+            root_level = depth[root]
+            visited.add(root)
+            worklist = [root]
+            while len(worklist) > 0:
+                node = worklist.pop()
+                for s in index.succs(node):
+                    # dominator tree edges go deeper than the root, skipped as well
+                    if depth[s] > root_level or s in idf:
+                        continue
+                    idf.add(s)
+                    if s not in defs:
+                        heappush(heap, (-depth[s], s))
+                for c in children[node]:
+                    if c not in visited:
+                        visited.add(c)
+                        worklist.append(c)
+        return bits_of(idf)
+
+    def iterated_dom_frontiers(self, bbs: Iterable[BasicBlock]) -> BlockSet:
+        """Iterated dominance frontier of blocks `bbs`
+        """
+        return self.index.block_set(self.iterated_frontier_bits(self.index.bits_of(bbs)))
+
+    def walk(self, root: int = 0) -> Iterator[tuple[int, bool]]:
+        """Depth-first walk of the tree below block index `root` with an explicit stack
+
+        Yields:
+            tuple[int, bool]: `(b, True)` on entering block index `b`,
+                `(b, False)` once every block it dominates is left
+        """
+        children = self.children_idx
+        yield root, True
+        stack = [(root, iter(children[root]))]
+        while len(stack) > 0:
+            v, it = stack[-1]
+            for c in it:
+                yield c, True
+                stack.append((c, iter(children[c])))
+                break
+            else:
+                stack.pop()
+                yield v, False
+
+    def preorder(self, root: int = 0) -> Iterator[int]:
+        """Block indices of the tree below `root`, dominators first
+        """
+        return (b for b, entering in self.walk(root) if entering)
+
+    def postorder(self, root: int = 0) -> Iterator[int]:
+        """Block indices of the tree below `root`, dominated blocks first
+        """
+        return (b for b, entering in self.walk(root) if not entering)
+
+    @property
+    def numbering(self) -> DomTreeNumbering:
+        """DFS interval numbering and LCA table of this tree, built on first access
+        """
+        if self._numbering is None:
+            self._numbering = DomTreeNumbering(self.children_idx)
+        return self._numbering
+
+    def dominates(self, a: BasicBlock, b: BasicBlock) -> bool:
+        """Whether `a` dominates `b` (every block dominates itself), in O(1)
+
+        Blocks unreachable from the entry block are only dominated by themselves.
+        """
+        if a is b:
+            return True
+        numbering = self.numbering
+        ia, ib = self.index.index_of(a), self.index.index_of(b)
+        return numbering.in_tree(ia) and numbering.dominates(ia, ib)
+
+    def strictly_dominates(self, a: BasicBlock, b: BasicBlock) -> bool:
+        """Whether `a` dominates `b` and `a` is not `b`, in O(1)
+        """
+        return a is not b and self.dominates(a, b)
+
+    def nearest_common_dominator(self, a: BasicBlock, b: BasicBlock) -> Optional[BasicBlock]:
+        """The deepest block dominating both `a` and `b`, in O(1)
+
+        Returns:
+            Optional[BasicBlock]: `None` if either block is unreachable
+        """
+        if a is b:
+            return a
+        numbering = self.numbering
+        ia, ib = self.index.index_of(a), self.index.index_of(b)
+        if not numbering.in_tree(ia) or not numbering.in_tree(ib):
+            return None
+        return self.index.blocks[numbering.nca(ia, ib)]
+
+    # -------- [Incremental updates] --------
+
+    def _editable(self) -> EditableCfgIndex:
+        """Switch to an editable index and explicit depths before the first edit
+        """
+        if not isinstance(self.index, EditableCfgIndex):
+            self._depth = list(self.numbering.depth)
+            self.index = EditableCfgIndex(self.index)
+        self.cfg.invalidate_index()
+        # frontiers are updated in place by `_update_frontiers`, block indices stay stable
+        frontier_bits = self._frontier_bits
+        self._invalidate()
+        self._frontier_bits = frontier_bits
+        self._moved = set()
+        return self.index
+
+    def _reachable(self, b: int) -> bool:
+        return b == 0 or self.idom_idx[b] != -1
+
+    def _nca(self, a: int, b: int) -> int:
+        """Nearest common ancestor by walking up with depths, valid during edits
+        """
+        depth, idom = self._depth, self.idom_idx
+        while depth[a] > depth[b]:
+            a = idom[a]
+        while depth[b] > depth[a]:
+            b = idom[b]
+        while a != b:
+            a, b = idom[a], idom[b]
+        return a
+
+    def _set_idom(self, b: int, d: int):
+        """Move block `b` under `d` (`-1` to detach it) in the tree
+        """
+        blocks = self.index.blocks
+        old = self.idom_idx[b]
+        if old == d:
+            return
+        self._moved.update((b, old, d))
+        if old != -1:
+            self.children_idx[old].remove(b)
+            self._sync_children(old)
+        self.idom_idx[b] = d
+        self.idom[blocks[b]] = None if d == -1 else blocks[d]
+        if d != -1:
+            insort(self.children_idx[d], b, key=lambda c: blocks[c].label)
+            self._sync_children(d)
+
+    def _sync_children(self, d: int):
+        blocks = self.index.blocks
+        if len(self.children_idx[d]) > 0:
+            self.children[blocks[d].label] = [blocks[c] for c in self.children_idx[d]]
+        else:
+            self.children.pop(blocks[d].label, None)
+
+    def _update_depths(self, root: int):
+        depth = self._depth
+        stack = [root]
+        while len(stack) > 0:
+            d = stack.pop()
+            for c in self.children_idx[d]:
+                depth[c] = depth[d] + 1
+                stack.append(c)
+
+    def _insert_reachable(self, u: int, v: int):
+        """Depth-based search for the blocks whose immediate dominator becomes
+        `nca(u, v)` after inserting edge `u -> v` between reachable blocks
+        (Georgiadis et al., "An Experimental Study of Dynamic Dominators")
+
+        A block `w` is affected iff it is deeper than a child of the `nca` and
+        reachable from `v` through blocks not shallower than `w`.
+        """
+        depth, index = self._depth, self.index
+        nca = self._nca(u, v)
+        threshold = depth[nca] + 1
+        if depth[v] <= threshold:
+            return
+        visited = { v }
+        heap = [(-depth[v], v)]
+        affected: list[int] = []
+        while len(heap) > 0:
+            _, z = heappop(heap)
+            affected.append(z)
+            stack = [z]
+            while len(stack) > 0:
+                x = stack.pop()
+                for w in index.succs(x):
+                    if w in visited or not self._reachable(w):
+                        continue
+                    if depth[w] > depth[z]:
+                        visited.add(w)
+                        stack.append(w)
+                    elif depth[w] > threshold:
+                        visited.add(w)
+                        heappush(heap, (-depth[w], w))
+        for z in affected:
+            self._set_idom(z, nca)
+            depth[z] = threshold
+            self._update_depths(z)
+
+    def _rebuild_subtree(self, r: int):
+        """Recompute the dominators of the subtree rooted at `r` with semi-NCA,
+        its blocks not reachable from `r` anymore become unreachable
+        """
+        index, idom = self.index, self.idom_idx
+        subtree = [r]
+        for d in subtree:
+            subtree.extend(self.children_idx[d])
+        in_subtree = set(subtree)
+        order, new_idom = Cfg2IdomSemiNca.idom_from(index, r, in_subtree.__contains__)
+        reached = set(order)
+        lost = [x for x in subtree if x not in reached]
+        # blocks losing all paths may have been the only support of blocks
+        # outside the subtree, rebuild from a root dominating them as well
+        root = r
+        for x in lost:
+            for w in index.succs(x):
+                if w not in in_subtree and self._reachable(w):
+                    root = self._nca(root, w)
+        if root != r:
+            return self._rebuild_subtree(root)
+
+        for x in subtree[1:]:
+            self._set_idom(x, -1)
+        for b, d in zip(order[1:], new_idom[1:]):
+            self._set_idom(b, d)
+        self._update_depths(r)
+
+    def _update_frontiers(self, u: int, v: int):
+        """Recompute the dominance frontiers an edit of edge `u -> v` may change
+
+        `DF(x)` only changes if a block enters or leaves the subtree of `x`,
+        or if the predecessors of a join in it change, so only the ancestors
+        of the blocks whose immediate dominator or parent changed, of `u` and
+        of the predecessors of `v` are recomputed, deepest first, by
+        `DF(x) = (joins among succs(x) | DF(c) for children c) - children(x)`.
+        """
+        df = self._frontier_bits
+        if df is None:  # never computed, built on first access
+            return
+        index, idom, depth = self.index, self.idom_idx, self._depth
+        stale: set[int] = set()
+        for x in (*self._moved, u, *index.preds(v)):
+            while x != -1 and x not in stale:
+                stale.add(x)
+                x = idom[x]
+        for x in sorted(stale, key=lambda x: depth[x] if self._reachable(x) else 0, reverse=True):
+            bits = child_bits = 0
+            for s in index.succs(x):
+                if len(index.preds(s)) > 1:
+                    bits |= 1 << s
+            for c in self.children_idx[x]:
+                bits |= df[c]
+                child_bits |= 1 << c
+            df[x] = bits & ~child_bits
+
+    def insert_edge(self, u: BasicBlock, v: BasicBlock):
+        """Add CFG edge `u -> v` and update the tree and frontiers incrementally
+
+        The edge is added to `u.succs` and `v.preds` if missing,
+        instructions (terminators) are left to the caller.
+        Merge sets and dominance query tables are rebuilt on next access.
+
+        Raises:
+            ValueError: if `v` is the entry block, which has no predecessors
+        """
+        index = self._editable()
+        iu, iv = index.index_of(u), index.index_of(v)
+        if iv == 0:
+            err = ValueError(f"Can't add edge {u} -> {v} into the entry block")
+            logger.error(err)
+            raise err
+        u.succs.add(v)
+        v.preds.add(u)
+        if index.has_edge(iu, iv):
+            return
+        index.add_edge(iu, iv)
+        self._insert_edge(iu, iv)
+        self._update_frontiers(iu, iv)
+
+    def _insert_edge(self, iu: int, iv: int):
+        index = self.index
+        if not self._reachable(iu):
+            return
+        if self._reachable(iv):
+            self._insert_reachable(iu, iv)
+            return
+
+        # `v` and the blocks only reachable through it become reachable
+        newly = [iv]
+        seen = { iv }
+        for x in newly:
+            for w in index.succs(x):
+                if w not in seen and not self._reachable(w):
+                    seen.add(w)
+                    newly.append(w)
+        order, new_idom = Cfg2IdomSemiNca.idom_from(index, iv, seen.__contains__)
+        self._set_idom(iv, iu)
+        for b, d in zip(order[1:], new_idom[1:]):
+            self._set_idom(b, d)
+        self._depth[iv] = self._depth[iu] + 1
+        self._update_depths(iv)
+        # edges from them into the old reachable region are plain insertions
+        for x in newly:
+            for w in index.succs(x):
+                if w not in seen:
+                    self._insert_reachable(x, w)
+
+    def delete_edge(self, u: BasicBlock, v: BasicBlock):
+        """Remove CFG edge `u -> v` and update the tree incrementally
+
+        Only the subtree of the nearest common dominator of `u` and `v`
+        is recomputed, see `insert_edge` for what is left to the caller.
+        """
+        index = self._editable()
+        iu, iv = index.index_of(u), index.index_of(v)
+        u.succs.discard(v)
+        v.preds.discard(u)
+        if not index.has_edge(iu, iv):
+            return
+        index.remove_edge(iu, iv)
+        if self._reachable(iu):
+            self._rebuild_subtree(self._nca(iu, iv))
+        self._update_frontiers(iu, iv)
+
+    def insert_block(self, bb: BasicBlock):
+        """Add a new block to the CFG and this tree, then the edges already
+        in `bb.preds` and `bb.succs` by `insert_edge`
+        """
+        if bb.label in self.index.label2idx:
+            err = ValueError(f"Block {bb} is already in the dominator tree")
+            logger.error(err)
+            raise err
+        index = self._editable()
+        self.cfg.blocks[bb.label] = bb
+        index.add_block(bb)
+        self.idom_idx.append(-1)
+        self.idom[bb] = None
+        self.children_idx.append([])
+        self._depth.append(0)
+        if self._frontier_bits is not None:
+            self._frontier_bits.append(0)
+        for p in list(bb.preds):
+            self.insert_edge(p, bb)
+        for s in list(bb.succs):
+            self.insert_edge(bb, s)
@@ -1,14 +1,212 @@
+import argparse
+import contextlib
+import json
+import os
 import sys
-from bril import parse_bril, serialize_bril, Program
-from ssa_construct import construct_ssa
+import textwrap
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Iterable, Optional, TextIO
+import bril
+from bril import Function, FunctionReader, dumps_json
+from columnar import ColumnarFunction, construct_ssa as construct_ssa_columnar
+from ssa_braun import construct_ssa_braun
+from ssa_construct import SSA_MODES, construct_ssa
+from ssa_destruct import destruct_ssa
 
-def main():
-    import argparse
+PARALLEL_MIN_INSTRS = 20000
+"""Programs with fewer instructions are transformed serially,
+as starting worker processes would cost more than it saves
+"""
+
+def transform(func: dict[str, Any], args: argparse.Namespace) -> tuple[Function, str]:
+    """Transform one function as the command line `args` ask
+
+    Returns:
+        tuple[Function, str]: the transformed function and its stats line
+    """
+    if args.ir == 'columnar':
+        columnar = ColumnarFunction.from_dict(func)
+        n_phis, n_removed = construct_ssa_columnar(columnar, args.mode), 0
+        function = columnar.to_function()
+    elif args.engine == 'braun':
+        function = Function(func)
+        n_phis, n_removed = construct_ssa_braun(function)
+    else:
+        function = Function(func)
+        n_phis, n_removed = construct_ssa(function, args.mode, args.remove_trivial_phis)
+    if args.out_of_ssa:
+        n_copies = destruct_ssa(function, not args.no_coalesce)
+    setup = args.engine if args.engine == 'braun' else f"{args.engine}, {args.mode}"
+    if args.ir == 'columnar':
+        setup += ", columnar"
+    copies = f", {n_copies} copies out of SSA" if args.out_of_ssa else ""
+    stats = f"{function.name}: {n_phis} phis ({setup}), {n_removed} trivial removed{copies}"
+    return function, stats
+
+def transform_function(func: dict[str, Any], args: argparse.Namespace) -> tuple[dict[str, Any], str]:
+    """`transform` giving the function as a `dict`, which worker processes can send back
+    """
+    function, stats = transform(func, args)
+    return function.to_dict(), stats
+
+def transform_functions(funcs: list[dict[str, Any]],
+                        args: argparse.Namespace,
+                        jobs: int = 1,
+                        pool: Optional[Executor] = None) -> list[tuple[dict[str, Any], str]]:
+    """Transform the functions of a program, in parallel over `jobs` processes
+    unless the program is small
+
+    Functions are handed out largest first to balance the load,
+    results come back in the original order. The work goes to `pool`
+    if given, otherwise to a pool started for this program.
+    """
+    sizes = [len(func.get('instrs', [])) for func in funcs]
+    if jobs <= 1 or len(funcs) < 2 or sum(sizes) < PARALLEL_MIN_INSTRS:
+        return [transform_function(func, args) for func in funcs]
+    order = sorted(range(len(funcs)), key=lambda n: sizes[n], reverse=True)
+    with contextlib.nullcontext(pool) if pool is not None else ProcessPoolExecutor(min(jobs, len(funcs))) as pool:
+        futures = { n: pool.submit(transform_function, funcs[n], args) for n in order }
+        return [futures[n].result() for n in range(len(funcs))]
+
+def transform_program(program: dict[str, Any],
+                      args: argparse.Namespace,
+                      jobs: int = 1,
+                      pool: Optional[Executor] = None) -> dict[str, Any]:
+    """Transform every function of a program, see `transform_functions`
+    """
+    results = transform_functions(program.get('functions', []), args, jobs, pool)
+    if args.stats:
+        for _, stats in results:
+            print(stats, file=sys.stderr)
+    return { 'functions': [func for func, _ in results] }
+
+def run_batch(lines: Iterable[str], args: argparse.Namespace, jobs: int, out: TextIO) -> tuple[int, int]:
+    """Transform a batch of programs, one per line, each given as
+    Bril JSON or as the path of a Bril JSON file
+
+    Each result is written to `out` as one line of JSON. A program that
+    fails gives an `{"error": ...}` line instead, the batch goes on.
+    With `jobs > 1`, one pool of worker processes serves the whole batch.
+
+    Returns:
+        tuple[int, int]: numbers of programs and failures
+    """
+    n_programs, n_failed = 0, 0
+    with ProcessPoolExecutor(jobs) if jobs > 1 else contextlib.nullcontext() as pool:
+        for line in lines:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            n_programs += 1
+            try:
+                if line.startswith('{'):
+                    program = json.loads(line)
+                else:
+                    with open(line, 'r') as f:
+                        program = json.load(f)
+                result = transform_program(program, args, jobs, pool)
+            except Exception as err:
+                n_failed += 1
+                print(f"program {n_programs}: {type(err).__name__}: {err}", file=sys.stderr)
+                result = { 'error': f"{type(err).__name__}: {err}" }
+            out.write(dumps_json(result, compact=True))
+            out.write('\n')
+    return n_programs, n_failed
 
+def write_transformed(funcs: Iterable[dict[str, Any]], args: argparse.Namespace, fout: TextIO) -> int:
+    """Transform the functions of a program serially, writing each out as a
+    program to `fout` once transformed
+
+    The output is the same as `dumps_json` of `transform_program`. Without
+    orjson, compact output is written by `Function.write_json`, never building
+    the `dict` of a transformed function.
+
+    Returns:
+        int: number of functions
+    """
+    if args.compact:
+        head, sep, tail, empty = '{"functions":[', ',', ']}', '{"functions":[]}'
+    else:
+        head, sep, tail, empty = '{\n  "functions": [\n', ',\n', '\n  ]\n}', '{\n  "functions": []\n}'
+    n_funcs = 0
+    for func in funcs:
+        function, stats = transform(func, args)
+        if args.stats:
+            print(stats, file=sys.stderr)
+        fout.write(head if n_funcs == 0 else sep)
+        if args.compact and bril.orjson is None:
+            function.write_json(fout)
+        else:
+            text = dumps_json(function.to_dict(), args.compact)
+            fout.write(text if args.compact else textwrap.indent(text, '    '))
+        n_funcs += 1
+    fout.write(empty if n_funcs == 0 else tail)
+    return n_funcs
+
+def run_stream(fin: TextIO, args: argparse.Namespace, fout: TextIO) -> int:
+    """Transform a program function by function, each is parsed, transformed,
+    written out and dropped before the next one is read, see `write_transformed`
+
+    Returns:
+        int: number of functions
+    """
+    return write_transformed(FunctionReader(fin), args, fout)
+
+def main():
     parser = argparse.ArgumentParser(description='SSA Construction for Bril Programs')
     parser.add_argument('--input', type=str, help='Input Bril JSON file', default=None)
     parser.add_argument('--output', type=str, help='Output Bril JSON file', default=None)
+    parser.add_argument('--engine', choices=('cytron', 'braun'), default='cytron',
+                        help='SSA construction: cytron (dominance frontiers) or braun (on the fly)')
+    parser.add_argument('--mode', choices=SSA_MODES, help='Phi placement mode of cytron', default='minimal')
+    parser.add_argument('--ir', choices=('objects', 'columnar'), default='objects',
+                        help='In-memory representation of functions, columnar runs cytron only')
+    parser.add_argument('--remove-trivial-phis', action='store_true', help='Remove phis merging a single value')
+    parser.add_argument('--out-of-ssa', action='store_true', help='Translate back out of SSA after construction')
+    parser.add_argument('--no-coalesce', action='store_true', help='Keep a copy for every phi operand out of SSA')
+    parser.add_argument('--stats', action='store_true', help='Report phi and copy counts to stderr')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Worker processes to transform functions with, 0 for one per CPU')
+    parser.add_argument('--batch', action='store_true',
+                        help='Input has a program per line, as Bril JSON or a file path, output a result per line')
+    parser.add_argument('--compact', action='store_true', help='Output JSON without indentation')
+    parser.add_argument('--stream', action='store_true',
+                        help='Read, transform and write one function at a time, serially')
     args = parser.parse_args()
+    if args.ir == 'columnar' and (args.engine != 'cytron' or args.remove_trivial_phis):
+        parser.error("--ir columnar supports the cytron engine without --remove-trivial-phis")
+    if args.batch and args.stream:
+        parser.error("--batch and --stream are exclusive")
+    if args.stream and args.jobs != 1:
+        parser.error("--stream transforms functions serially, without --jobs")
+
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count() or 1
+
+    if args.batch:
+        fin = open(args.input, 'r') if args.input else sys.stdin
+        fout = open(args.output, 'w') if args.output else sys.stdout
+        start = time.perf_counter()
+        n_programs, n_failed = run_batch(fin, args, jobs, fout)
+        elapsed = time.perf_counter() - start
+        for f in (fin, fout):
+            if f not in (sys.stdin, sys.stdout):
+                f.close()
+        rate = n_programs / elapsed if elapsed > 0 else 0.0
+        print(f"{n_programs} programs, {n_failed} failed in {elapsed:.2f}s ({rate:.1f} programs/sec)",
+              file=sys.stderr)
+        sys.exit(1 if n_failed > 0 else 0)
+
+    if args.stream:
+        fin = open(args.input, 'r') if args.input else sys.stdin
+        fout = open(args.output, 'w') if args.output else sys.stdout
+        run_stream(fin, args, fout)
+        for f in (fin, fout):
+            if f not in (sys.stdin, sys.stdout):
+                f.close()
+        if fout is sys.stdout:
+            print()
+        return
 
     if args.input:
         with open(args.input, 'r') as f:
@@ -16,12 +214,19 @@ def main():
     else:
         json_input = sys.stdin.read()
 
-    program = parse_bril(json_input)
+    if args.compact and bril.orjson is None and jobs <= 1:
+        # written as transformed, without the dicts of the output program
+        fout = open(args.output, 'w') if args.output else sys.stdout
+        write_transformed(json.loads(json_input).get('functions', []), args, fout)
+        if fout is sys.stdout:
+            print()
+        else:
+            fout.close()
+        return
 
-    for function in program.functions:
-        construct_ssa(function)
+    program = transform_program(json.loads(json_input), args, jobs)
 
-    json_output = serialize_bril(program)
+    json_output = dumps_json(program, args.compact)
 
     if args.output:
         with open(args.output, 'w') as f:
@@ -6,11 +6,15 @@ from instruction.common import OpType
 
 class Instruction:
     """Abstract class of an instruction
+
+    Instructions keep only their fields in `__slots__`, not the JSON they are
+    parsed from, and immutable `args`/`labels` are tuples.
     """
-    
+
+    __slots__ = ('op',)
+
     def __init__(self, instr: Dict[str, Any]):
         self.op: Optional[OpType] = OpType.find(instr.get('op'))
-        self.instr = instr
 
     def to_dict(self) -> Dict[str, Any]:
         result = {}
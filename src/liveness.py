@@ -0,0 +1,182 @@
+from operator import or_
+from typing import Iterable, Optional
+from cfg import CFG, BasicBlock
+from dataflow import Dataflow
+from instruction.ssa import SsaOpType
+from util import iter_bits
+
+class VarIndex:
+    """Interned variable ids, so variable sets can be bitsets
+    """
+
+    def __init__(self):
+        self.names: list[str] = []
+        """variable name of each id
+        """
+        self.ids: dict[str, int] = {}
+        """id of each variable name
+        """
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.ids
+
+    def intern(self, name: str) -> int:
+        """Id of variable `name`, assigning a new one the first time
+        """
+        vid = self.ids.get(name)
+        if vid is None:
+            vid = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return vid
+
+    def bits_of(self, names: Iterable[str]) -> int:
+        """Bitset of the known variables among `names`
+        """
+        ids = self.ids
+        found = sorted(set(ids[name] for name in names if name in ids), reverse=True)
+        if len(found) == 0:
+            return 0
+        # shift in from the highest id, so the partial sets only span the ids seen
+        bits, prev = 1, found[0]
+        for vid in found[1:]:
+            bits = (bits << (prev - vid)) | 1
+            prev = vid
+        return bits << prev
+
+    def names_of(self, bits: int) -> set[str]:
+        """Variable names in bitset `bits`
+        """
+        return set(self.names[v] for v in iter_bits(bits))
+
+def uses_and_defs(bb: BasicBlock) -> tuple[set[str], set[str]]:
+    """Variables of block `bb` used before any definition in it,
+    and variables defined in it, phi functions excluded
+
+    Returns:
+        tuple[set[str], set[str]]: `(upward exposed uses, definitions)`
+    """
+    uses: set[str] = set()
+    defs: set[str] = set()
+    for i in bb.insts:
+        if i.op == SsaOpType.PHI:
+            continue
+        args = getattr(i, 'args', None)
+        if args is not None:
+            uses.update(arg for arg in args if arg not in defs)
+        dest = getattr(i, 'dest', None)
+        if dest is not None:
+            defs.add(dest)
+    return uses, defs
+
+class Liveness:
+    """Live variables at the entry and exit of each block of a `CFG`,
+    as bitsets over interned variable ids and indexed like `cfg.index`
+
+    In the SSA-aware mode a phi defines its dest on entry of its block,
+    and each operand is used at the exit of the predecessor it comes from:
+
+    * `live_in(b) = phi_defs(b) | gen(b) | (live_out(b) & ~kill(b))`
+    * `live_out(b) = phi_uses(b) | (live_in(s) & ~phi_defs(s)) for s in succs(b)`
+
+    The pre-SSA mode ignores phis, both placed ones and those in the body.
+    """
+
+    def __init__(self, cfg: CFG, ssa: bool = False, vars: Optional[VarIndex] = None):
+        """Solve liveness of `cfg`
+
+        Args:
+            cfg (CFG): the function to analyze
+            ssa (bool, optional): whether to be SSA-aware. Defaults to `False`.
+            vars (VarIndex, optional): variable ids to extend, a new one if not given
+        """
+        self.cfg = cfg
+        self.index = cfg.index
+        self.ssa = ssa
+        self.vars = vars if vars is not None else VarIndex()
+        n = len(self.index)
+        # Only variables used before defined in some block or merged by
+        # some phi can be live across blocks, the others need no id
+        gen_names, kill_names = [], []
+        phi_def_names: list[list[str]] = [[] for _ in range(n)]
+        phi_use_names: list[list[str]] = [[] for _ in range(n)]
+        for b, bb in enumerate(self.index.blocks):
+            gen, kill = self._scan(bb, phi_def_names[b], phi_use_names)
+            gen_names.append(gen)
+            kill_names.append(kill)
+        # interned block by block in reverse postorder, so each set spans few ids
+        intern = self.vars.intern
+        for b in range(n):
+            for names in (phi_def_names[b], gen_names[b], phi_use_names[b]):
+                for name in names:
+                    intern(name)
+        bits_of = self.vars.bits_of
+        self.gen = [bits_of(names) for names in gen_names]
+        """variables used before any definition in each block
+        """
+        self.kill = [bits_of(names) for names in kill_names]
+        """variables defined in each block
+        """
+        self.phi_defs = [bits_of(names) for names in phi_def_names]
+        """variables defined by phis in each block
+        """
+        self.phi_uses = [bits_of(names) for names in phi_use_names]
+        """phi operands flowing out of each block
+        """
+        self.live_in: list[int] = []
+        self.live_out: list[int] = []
+        self.visits = 0
+        """number of blocks the dataflow worklist has processed
+        """
+        self._solve()
+
+    def _scan(self,
+              bb: BasicBlock,
+              phi_defs: list[str],
+              phi_uses: list[list[str]]) -> tuple[set[str], set[str]]:
+        """Collect the variables block `bb` uses before defining and defines,
+        its phi dests into `phi_defs` and phi operands into `phi_uses` of predecessors
+        """
+        if self.ssa:
+            label2idx = self.index.label2idx
+            for phi in bb.get_by_op(SsaOpType.PHI):
+                phi_defs.append(phi.dest)
+                for label, arg in phi.operands.items():
+                    phi_uses[label2idx[label]].append(arg)
+        return uses_and_defs(bb)
+
+    def _solve(self):
+        """Backward dataflow, phi dests are cut off on the edges into their blocks
+        """
+        gen, kill, phi_defs, phi_uses = self.gen, self.kill, self.phi_defs, self.phi_uses
+        flow = Dataflow(self.index, False, or_,
+                        lambda b, out: phi_defs[b] | gen[b] | ((out | phi_uses[b]) & ~kill[b]),
+                        top=0, boundary=0,
+                        edge=(lambda s, b, live: live & ~phi_defs[s]) if self.ssa else None)
+        self.live_in = flow.outs
+        self.live_out = [out | uses for out, uses in zip(flow.ins, phi_uses)]
+        self.visits = flow.visits
+
+    def live_in_of(self, bb: BasicBlock) -> set[str]:
+        """Variables live on entry of `bb`
+        """
+        return self.vars.names_of(self.live_in[self.index.label2idx[bb.label]])
+
+    def live_out_of(self, bb: BasicBlock) -> set[str]:
+        """Variables live on exit of `bb`
+        """
+        return self.vars.names_of(self.live_out[self.index.label2idx[bb.label]])
+
+    def is_live_in(self, var: str, b: int) -> bool:
+        """Whether `var` is live on entry of block index `b`
+        """
+        vid = self.vars.ids.get(var)
+        return vid is not None and (self.live_in[b] >> vid) & 1 == 1
+
+    def is_live_out(self, var: str, b: int) -> bool:
+        """Whether `var` is live on exit of block index `b`
+        """
+        vid = self.vars.ids.get(var)
+        return vid is not None and (self.live_out[b] >> vid) & 1 == 1
@@ -1,18 +1,34 @@
+import argparse
+import io
+import json
 import os
+import random
 import subprocess
 import sys
+from operator import or_
 from typing import Optional
 from unittest import TextTestRunner, TestSuite, defaultTestLoader
 from cfg import CFG, BasicBlock
-from bril import Const, ValueOperation, parse_bril, serialize_bril
+import bril
+from bril import Const, Function, Phi, Program, ValueOperation, parse_bril, serialize_bril
 from instruction.common import ValType
+from util import NameGenerator, bits_of
 from is_ssa import is_ssa
 from instruction.instruction import Instruction
-from instruction.value import CoreValType
+from instruction.value import CoreValType, NullityType
 from instruction.ssa import SsaOpType
+from instruction.trivial import TrivialOpType
+from instruction.control import CtrlOpType
 from logger.logger import logger
-from ssa_construct import collect_definitions, construct_ssa, def2global_d2b, insert_phi_functions, reconstruct_instructions, rename_variables
-from dominance import Cfg2Dom, Dom2Idom, DominatorTree, Idom2Df
+from dataflow import Dataflow
+from liveness import Liveness, VarIndex, uses_and_defs
+from ssa_braun import construct_ssa_braun
+from ssa_destruct import destruct_ssa, sequentialize
+import columnar
+from columnar import ColumnarCfg, ColumnarFunction
+import driver
+from ssa_construct import SSA_MODES, collect_definitions, construct_ssa, def2global_d2b, insert_phi_functions, reconstruct_instructions, remove_trivial_phis, rename_variables
+from dominance import DOM_BACKENDS, IDF_ENGINES, Cfg2Dom, Cfg2Idom, Cfg2IdomBySets, Cfg2IdomSemiNca, Dom2Idom, DominatorTree, Idom2Df, cross_check_idom, idom2dict
 from logger.logger import LoggedTestCase
 from logger.test import LoggerTest
 from instruction.test import InstTest
@@ -77,6 +93,37 @@ def find_all_bril(entry: str):
     _traverse(entry)
     return res
             
+def gen_program(n_blocks: int, seed: int = 0, n_vars: int = 8):
+    """Generate a single-function program of `n_blocks` blocks with random
+    (possibly irreducible) branches, every block is reachable from the entry
+    """
+    rnd = random.Random(seed)
+    variables = [f"v{n}" for n in range(n_vars)]
+    instrs = [{ "op": "const", "dest": v, "type": "int", "value": n }
+              for n, v in enumerate(variables)]
+    for b in range(n_blocks):
+        instrs.append({ "label": f"L{b}" })
+        dest, lhs, rhs = rnd.choice(variables), rnd.choice(variables), rnd.choice(variables)
+        instrs.append({ "op": "add", "dest": dest, "type": "int", "args": [lhs, rhs] })
+        if b == n_blocks - 1:
+            instrs.append({ "op": "print", "args": [variables[0]] })
+        elif rnd.random() < 0.6:
+            # branch anywhere, or fall through to the next block
+            instrs.append({ "op": "lt", "dest": "cond", "type": "bool", "args": [lhs, rhs] })
+            instrs.append({ "op": "br", "args": ["cond"],
+                            "labels": [f"L{rnd.randrange(n_blocks)}", f"L{b + 1}"] })
+    return Program({ "functions": [{ "name": "main", "instrs": instrs }] })
+
+def deep_program(n_blocks: int) -> Program:
+    """A straight line of `n_blocks` blocks, each reading `x` into `v{b}`
+    """
+    instrs = [{ "op": "const", "dest": "x", "type": "int", "value": 0 }]
+    for b in range(n_blocks):
+        instrs.append({ "label": f"L{b}" })
+        instrs.append({ "op": "add", "dest": f"v{b}", "type": "int", "args": ["x", "x"] })
+    instrs.append({ "op": "print", "args": [f"v{n_blocks - 1}"] })
+    return Program({ "functions": [{ "name": "main", "instrs": instrs }] })
+
 def bb2labels(s: set[BasicBlock]):
     return set(bb.label for bb in s)
 
@@ -208,6 +255,58 @@ def test_brils_ssa(path: str):
 
 # -------- [Test suites] --------
 
+class SerializeTest(LoggedTestCase):
+    def test_backends(self):
+        basic_tests = os.path.realpath(f"{script_dir}/../tests")
+        programs = [load_program(bril_file) for bril_file in find_all_bril(basic_tests)]
+        for program in programs[::2]:
+            for func in program.functions:
+                construct_ssa(func)
+        programs.append(gen_program(200, seed=1))
+        orjson = bril.orjson
+        try:
+            for backend in (orjson, None):
+                bril.orjson = backend
+                for program in programs:
+                    prog = program.to_dict()
+                    self.assertEqual(serialize_bril(program), json.dumps(prog, indent=2))
+                    compact = serialize_bril(program, compact=True)
+                    self.assertEqual(compact, json.dumps(prog, separators=(',', ':')))
+                    out = io.StringIO()
+                    program.write_json(out)
+                    self.assertEqual(out.getvalue(), compact)
+        finally:
+            bril.orjson = orjson
+
+    def test_lazy_instrs(self):
+        prog = load_program().to_dict()
+        for func in prog['functions']:
+            raw = func['instrs']
+            function = Function(func)
+            self.assertFalse(function.parsed)
+            self.assertIs(function.to_dict()['instrs'], raw)
+            out = io.StringIO()
+            function.write_json(out)
+            self.assertEqual(out.getvalue(), json.dumps(function.to_dict(), separators=(',', ':')))
+            self.assertEqual(len(function.instrs), len(raw))
+            self.assertTrue(function.parsed)
+            self.assertListEqual(function.to_dict()['instrs'], raw)
+        # invalid instructions are found once parsed
+        function = Function({ "name": "f", "instrs": [{ "op": "const", "dest": "x" }] })
+        self.assertEqual(len(function.to_dict()['instrs']), 1)
+        with self.assertRaises(ValueError):
+            function.instrs
+
+    def test_slots(self):
+        program = gen_program(100, seed=2)
+        prog = program.to_dict()
+        for i in program.functions[0].instrs:
+            self.assertFalse(hasattr(i, '__dict__'))
+            for field in ('args', 'labels'):
+                if getattr(i, field, None) is not None:
+                    self.assertIsInstance(getattr(i, field), tuple)
+        self.assertDictEqual(program.to_dict(), json.loads(json.dumps(prog)))
+
 class BasicBlockTest(LoggedTestCase):
     def test_eq(self):
         b1 = BasicBlock('b1')
@@ -253,6 +352,40 @@ class CfgTest(LoggedTestCase):
         asq(bb2labels(cfg.blocks['b8'].preds), set(('b5',)))
         asq(bb2labels(cfg.blocks['b8'].succs), set(('b7',)))
 
+    def test_label_names(self):
+        names = NameGenerator(['b1', 'b3'])
+        self.assertListEqual([names.new_name('b') for _ in range(3)], ['b2', 'b4', 'b5'])
+        self.assertEqual(names.new_name('x.', 0), 'x.0')
+        names.take('x.1')
+        self.assertEqual(names.new_name('x.', 0), 'x.2')
+
+        # an unlabeled leading block must not take a label used later
+        program = Program({ "functions": [{ "name": "main", "instrs": [
+            { "op": "const", "dest": "x", "type": "int", "value": 0 },
+            { "op": "jmp", "labels": ["b1"] },
+            { "label": "b1" },
+            { "op": "print", "args": ["x"] } ] }] })
+        cfg = CFG(program.functions[0])
+        self.assertListEqual(list(cfg.blocks), ['b2', 'b1'])
+        self.assertSetEqual(bb2labels(cfg.blocks['b2'].succs), { 'b1' })
+
+    def test_index(self):
+        program = load_program()
+        cfg = CFG(program.functions[0])
+        index = cfg.index
+        self.assertIs(index, cfg.index)
+        self.assertEqual(index.blocks[0], cfg.entry_block)
+        self.assertEqual(index.n_reachable, len(cfg.blocks))
+        for i, bb in enumerate(index.blocks):
+            self.assertEqual(index.label2idx[bb.label], i)
+            self.assertSetEqual(set(index.blocks[s] for s in index.succs(i)), bb.succs)
+            self.assertSetEqual(set(index.blocks[p] for p in index.preds(i)), bb.preds)
+        # successors are visited in block order
+        self.assertEqual([bb.label for bb in cfg.reverse_postorder()],
+                         ['b0', 'b1', 'b5', 'b8', 'b6', 'b7', 'b2', 'b3', 'b4'])
+        cfg.invalidate_index()
+        self.assertIsNot(index, cfg.index)
+
 class DomTest(LoggedTestCase):
     def test_make_dom(self):
         program = load_program()
@@ -305,6 +438,215 @@ class DomTest(LoggedTestCase):
         asq(bb2labels(label_dom['b7']), set(('b3',)))
         asq(bb2labels(label_dom['b8']), set(('b7',)))
 
+    def test_engineered_idom(self):
+        basic_tests = os.path.realpath(f"{script_dir}/../tests")
+        for bril_file in find_all_bril(basic_tests):
+            program = load_program(bril_file)
+            for func in program.functions:
+                cfg = CFG(func)
+                dom = Cfg2Dom.convert(cfg)
+                self.assertDictEqual(Cfg2Idom.convert(cfg), Dom2Idom.convert(dom))
+                dom_tree = DominatorTree(cfg)
+                self.assertDictEqual(dom_tree.dom, dom)
+                self.assertIs(dom_tree.dom, dom_tree.dom)
+
+    def test_bitsets(self):
+        program = load_program()
+        cfg = CFG(program.functions[0])
+        dom_tree = DominatorTree(cfg)
+        index = cfg.index
+        self.assertListEqual(dom_tree.dom_bits, Cfg2Dom.dom_of(index))
+        b3 = cfg.blocks['b3']
+        df = dom_tree.dom_frontiers[b3]
+        self.assertEqual(df, { cfg.blocks['b1'] })
+        self.assertIn(cfg.blocks['b1'], df)
+        self.assertNotIn(b3, df)
+        self.assertNotIn(BasicBlock('b1'), df)
+        self.assertEqual(df.bits, 1 << index.label2idx['b1'])
+        self.assertEqual(dom_tree.dom[b3] & dom_tree.dom[cfg.blocks['b5']],
+                         { cfg.blocks['b0'], cfg.blocks['b1'] })
+        self.assertSetEqual(bb2labels(dom_tree.iterated_dom_frontiers([cfg.blocks['b2']])),
+                            set(('b1', 'b3')))
+
+    def test_dominance_queries(self):
+        program = load_program()
+        cfg = CFG(program.functions[0])
+        dom_tree = DominatorTree(cfg)
+        bb = cfg.blocks
+        self.assertTrue(dom_tree.dominates(bb['b1'], bb['b7']))
+        self.assertTrue(dom_tree.dominates(bb['b3'], bb['b3']))
+        self.assertFalse(dom_tree.dominates(bb['b2'], bb['b3']))
+        self.assertFalse(dom_tree.strictly_dominates(bb['b1'], bb['b1']))
+        self.assertTrue(dom_tree.strictly_dominates(bb['b0'], bb['b4']))
+        self.assertEqual(dom_tree.nearest_common_dominator(bb['b2'], bb['b8']), bb['b1'])
+        self.assertEqual(dom_tree.nearest_common_dominator(bb['b6'], bb['b8']), bb['b5'])
+        self.assertEqual(dom_tree.nearest_common_dominator(bb['b4'], bb['b3']), bb['b3'])
+
+        # agree with dominator sets on a large function
+        cfg = CFG(gen_program(300, seed=5).functions[0])
+        dom_tree = DominatorTree(cfg)
+        blocks = cfg.index.blocks
+        dom_bits = dom_tree.dom_bits
+        rnd = random.Random(5)
+        for _ in range(2000):
+            a, b = rnd.randrange(len(blocks)), rnd.randrange(len(blocks))
+            self.assertEqual(dom_tree.dominates(blocks[a], blocks[b]), (dom_bits[b] >> a) & 1 == 1)
+            common = (dom_bits[a] & dom_bits[b]).bit_length() - 1
+            self.assertEqual(dom_tree.nearest_common_dominator(blocks[a], blocks[b]), blocks[common])
+
+    def test_idf_engines(self):
+        for n_blocks, seed in ((9, 0), (40, 1), (200, 2)):
+            cfg = CFG(gen_program(n_blocks, seed=seed).functions[0])
+            dom_tree = DominatorTree(cfg)
+            rnd = random.Random(seed)
+            for _ in range(100):
+                bits = bits_of(rnd.sample(range(len(dom_tree.index)), rnd.randint(1, 5)))
+                expected = dom_tree.iterated_frontier_bits(bits, 'df')
+                for engine in IDF_ENGINES:
+                    self.assertEqual(dom_tree.iterated_frontier_bits(bits, engine), expected)
+        with self.assertRaises(ValueError):
+            dom_tree.iterated_frontier_bits(1, 'nope')
+
+    def test_walk(self):
+        program = load_program()
+        cfg = CFG(program.functions[0])
+        dom_tree = DominatorTree(cfg)
+        blocks = dom_tree.index.blocks
+        pre = [blocks[b].label for b in dom_tree.preorder()]
+        post = [blocks[b].label for b in dom_tree.postorder()]
+        self.assertEqual(pre[0], 'b0')
+        self.assertEqual(post[-1], 'b0')
+        self.assertSetEqual(set(pre), set(cfg.blocks))
+        numbering = dom_tree.numbering
+        for order, number in ((dom_tree.preorder(), numbering.pre), (dom_tree.postorder(), numbering.post)):
+            self.assertListEqual([number[b] for b in order], list(range(len(blocks))))
+        # a subtree only
+        b1 = dom_tree.index.label2idx['b1']
+        self.assertSetEqual(set(dom_tree.preorder(b1)),
+                            set(b for b in range(len(blocks)) if numbering.dominates(b1, b)))
+
+class DomBackendTest(LoggedTestCase):
+    def test_cross_check_corpus(self):
+        basic_tests = os.path.realpath(f"{script_dir}/../tests")
+        for bril_file in find_all_bril(basic_tests):
+            program = load_program(bril_file)
+            for func in program.functions:
+                cfg = CFG(func)
+                dom_tree = DominatorTree(cfg, backend='cross-check')
+                for backend in DOM_BACKENDS:
+                    self.assertDictEqual(DominatorTree(cfg, backend).idom, dom_tree.idom)
+
+    def test_cross_check_generated(self):
+        for seed, n_blocks in enumerate((2, 10, 100, 600)):
+            cfg = CFG(gen_program(n_blocks, seed).functions[0])
+            cross_check_idom(cfg.index)
+
+    def test_auto_backend(self):
+        small = DominatorTree(CFG(load_program().functions[0]))
+        self.assertEqual(small.backend, 'chk')
+        large = DominatorTree(CFG(gen_program(1000).functions[0]))
+        self.assertEqual(large.backend, 'semi-nca')
+        with self.assertRaises(ValueError):
+            DominatorTree(small.cfg, backend='meow')
+
+class DynamicDomTest(LoggedTestCase):
+    def assertSameAsRecompute(self, dom_tree: DominatorTree):
+        full = DominatorTree(dom_tree.cfg)
+        self.assertDictEqual(dom_tree.idom, full.idom)
+        self.assertDictEqual(dom_tree.children, full.children)
+        self.assertDictEqual(dom_tree.dom_frontiers, full.dom_frontiers)
+        self.assertDictEqual(dom_tree.dom, full.dom)
+        rnd = random.Random(len(dom_tree.index))
+        for _ in range(5):
+            bits = rnd.getrandbits(len(dom_tree.index))
+            idfs = [dom_tree.iterated_frontier_bits(bits, engine) for engine in IDF_ENGINES]
+            self.assertListEqual(idfs, [idfs[0]] * len(idfs))
+
+    def test_split_edge(self):
+        program = load_program()
+        cfg = CFG(program.functions[0])
+        dom_tree = DominatorTree(cfg)
+        b3, b1 = cfg.blocks['b3'], cfg.blocks['b1']
+        split = BasicBlock('split')
+        dom_tree.insert_block(split)
+        dom_tree.insert_edge(b3, split)
+        dom_tree.insert_edge(split, b1)
+        dom_tree.delete_edge(b3, b1)
+        self.assertEqual(dom_tree.idom[split], b3)
+        self.assertTrue(dom_tree.dominates(b1, split))
+        self.assertSameAsRecompute(dom_tree)
+        # static backends need the reverse postorder of a fresh index
+        self.assertListEqual(Cfg2IdomSemiNca.idom_of(dom_tree.index), dom_tree.idom_idx)
+        for backend in (Cfg2Idom, Cfg2IdomBySets):
+            with self.assertRaises(ValueError):
+                backend.idom_of(dom_tree.index)
+            self.assertDictEqual(idom2dict(cfg.index, backend.idom_of(cfg.index)), dom_tree.idom)
+
+    def test_random_updates(self):
+        rnd = random.Random(0)
+        for seed in range(60):
+            cfg = CFG(gen_program(rnd.randint(1, 20), seed).functions[0])
+            dom_tree = DominatorTree(cfg)
+            for step in range(20):
+                blocks = list(cfg.blocks.values())
+                targets = [bb for bb in blocks if bb is not cfg.entry_block]
+                op = rnd.random()
+                if op < 0.45:
+                    dom_tree.insert_edge(rnd.choice(blocks), rnd.choice(targets))
+                elif op < 0.9:
+                    edges = [(u, v) for u in blocks for v in u.succs]
+                    if len(edges) > 0:
+                        dom_tree.delete_edge(*rnd.choice(edges))
+                else:
+                    bb = BasicBlock(f"new{step}")
+                    pred, succ = rnd.choice(blocks), rnd.choice(targets)
+                    bb.preds.add(pred)
+                    pred.succs.add(bb)
+                    bb.succs.add(succ)
+                    succ.preds.add(bb)
+                    dom_tree.insert_block(bb)
+                self.assertSameAsRecompute(dom_tree)
+
+    def test_entry_edge(self):
+        cfg = CFG(load_program().functions[0])
+        dom_tree = DominatorTree(cfg)
+        with self.assertRaises(ValueError):
+            dom_tree.insert_edge(cfg.blocks['b1'], cfg.entry_block)
+        self.assertEqual(len(cfg.entry_block.preds), 0)
+
+class DataflowTest(LoggedTestCase):
+    def test_dominators(self):
+        for n_blocks, seed in ((9, 0), (300, 1), (2000, 2)):
+            cfg = CFG(gen_program(n_blocks, seed=seed).functions[0])
+            dom_tree = DominatorTree(cfg)
+            self.assertListEqual(Cfg2Dom.dom_of(cfg.index), dom_tree.dom_bits)
+
+    def test_reachability(self):
+        # forward union: blocks on some path from the entry to each block
+        cfg = CFG(gen_program(200, seed=4).functions[0])
+        index = cfg.index
+        flow = Dataflow(index, True, or_, lambda b, x: x | (1 << b), top=0, boundary=0)
+        for b in range(len(index)):
+            for p in index.preds(b):
+                self.assertEqual(flow.outs[p] & ~flow.outs[b], 0)
+        self.assertEqual(flow.outs[0], 1)
+        self.assertLessEqual(flow.changes, flow.visits)
+
+    def test_visit_order(self):
+        # a straight line converges in one visit per block in either direction
+        n_blocks = 500
+        instrs = [{ "op": "const", "dest": "x", "type": "int", "value": 0 }]
+        for b in range(n_blocks):
+            instrs.append({ "label": f"L{b}" })
+            instrs.append({ "op": "add", "dest": "x", "type": "int", "args": ["x", "x"] })
+        instrs.append({ "op": "print", "args": ["x"] })
+        cfg = CFG(Program({ "functions": [{ "name": "main", "instrs": instrs }] }).functions[0])
+        n = len(cfg.index)
+        for forward in (True, False):
+            flow = Dataflow(cfg.index, forward, or_, lambda b, x: x | (1 << b), top=0, boundary=0)
+            self.assertEqual(flow.visits, n)
+        self.assertEqual(Liveness(cfg).visits, n)
+
 class SsaTest(LoggedTestCase):
     def test_collect_definitions(self):
         program = load_program()
@@ -355,9 +697,11 @@ class SsaTest(LoggedTestCase):
         def check_phi_for_var(var: str, golden: set[str]):
             bbs = set()
             for bb in cfg.blocks.values():
-                for i in bb.insts:
-                    if isinstance(i, ValueOperation) and i.op == SsaOpType.PHI and i.dest == var:
-                        bbs.add(bb.label)
+                if var in bb.phis:
+                    self.assertEqual(bb.phis[var].dest, var)
+                    bbs.add(bb.label)
+                self.assertListEqual([phi.var for phi in bb.ordered_phis()], sorted(bb.phis))
+                self.assertFalse(any(i.op == SsaOpType.PHI for i in bb.insts))
             self.assertSetEqual(bbs, golden)
         
         check_phi_for_var('a', { 'b1', 'b3' })
@@ -366,6 +710,14 @@ class SsaTest(LoggedTestCase):
         check_phi_for_var('d', { 'b1', 'b3', 'b7' })
         check_phi_for_var('i', { 'b1' })
 
+        # placing again finds the existing phis
+        b1 = cfg.blocks['b1']
+        self.assertFalse(b1.insert_phi_if_not_exist_for('a'))
+        self.assertTrue(b1.insert_phi_if_not_exist_for('aa'))
+        self.assertEqual(list(b1.phis)[-1], 'aa')
+        self.assertListEqual(b1.get_by_op(SsaOpType.PHI), [b1.phis[var] for var in sorted(b1.phis)])
+        self.assertListEqual(list(b1.phis), sorted(b1.phis))
+
     def test_dom_tree_links(self):
         program = load_program()
         cfg = CFG(program.functions[0])
@@ -389,7 +741,67 @@ class SsaTest(LoggedTestCase):
         global_d2b = def2global_d2b(defs, global_names)
         dom_tree = DominatorTree(cfg)
         insert_phi_functions(dom_tree, global_d2b)
-        rename_variables(cfg, dom_tree, defs, global_names)
+        rename_variables(cfg, dom_tree, defs)
+
+    def test_phi(self):
+        instr = { "op": "phi", "dest": "x.1", "type": "int",
+                  "args": ["x.0", "x.2"], "labels": ["b0", "b3"] }
+        phi = Function({ "name": "f", "instrs": [instr] }).instrs[0]
+        self.assertIsInstance(phi, Phi)
+        self.assertDictEqual(phi.operands, { "b0": "x.0", "b3": "x.2" })
+        self.assertDictEqual(phi.to_dict(), instr)
+        phi.operands["b0"] = "x.3"
+        phi.operands["b4"] = "x.UNDEFINED"
+        self.assertTupleEqual(phi.args, ("x.3", "x.2", "x.UNDEFINED"))
+        self.assertTupleEqual(phi.labels, ("b0", "b3", "b4"))
+        phi.args = ["y", "z", "w"]
+        self.assertDictEqual(phi.operands, { "b0": "y", "b3": "z", "b4": "w" })
+        phi.labels = ("b0", "b3", "b5")
+        self.assertDictEqual(phi.operands, { "b0": "y", "b3": "z", "b5": "w" })
+        with self.assertRaises(ValueError):
+            phi.args = ["y", "z"]
+        with self.assertRaises(ValueError):
+            phi.labels = ["b0", "b0", "b3"]
+        self.assertDictEqual(phi.operands, { "b0": "y", "b3": "z", "b5": "w" })
+        with self.assertRaises(ValueError):
+            Phi({ "op": "add", "dest": "x", "type": "int", "args": ["a", "b"] })
+
+        # a source variable with a dot keeps its name in the operands
+        program = Program({ "functions": [{ "name": "main", "instrs": [
+            { "op": "const", "dest": "v.1", "type": "int", "value": 0 },
+            { "op": "br", "args": ["c"], "labels": ["then", "join"] },
+            { "label": "then" },
+            { "op": "const", "dest": "v.1", "type": "int", "value": 1 },
+            { "label": "join" },
+            { "op": "print", "args": ["v.1"] } ] }] })
+        program.functions[0].args = [{ "name": "c", "type": "bool" }]
+        construct_ssa(program.functions[0])
+        self.assertTrue(is_ssa(program))
+        phis = [i for i in program.functions[0].instrs if i.op == SsaOpType.PHI]
+        self.assertEqual(len(phis), 1)
+        self.assertEqual(phis[0].var, "v.1")
+        self.assertEqual(phis[0].dest, "v.1.1")
+        self.assertDictEqual(phis[0].operands, { "b1": "v.1.0", "then": "v.1.2" })
+
+    def test_rename_generated(self):
+        program = gen_program(300, seed=3)
+        construct_ssa(program.functions[0])
+        self.assertTrue(is_ssa(program))
+        # every phi operand names a definition or an undefined value
+        defined = set(i.dest for i in program.functions[0].instrs if hasattr(i, 'dest'))
+        for i in program.functions[0].instrs:
+            if i.op == SsaOpType.PHI:
+                for arg in i.args:
+                    self.assertTrue(arg in defined or arg.endswith(NullityType.UNDEFINED.name))
+
+    def test_rename_deep(self):
+        # a straight line of blocks far deeper than the recursion limit
+        n_blocks = 20000
+        program = deep_program(n_blocks)
+        construct_ssa(program.functions[0])
+        self.assertTrue(is_ssa(program))
+        last = next(i for i in program.functions[0].instrs if getattr(i, 'dest', None) == f"v{n_blocks - 1}.0")
+        self.assertTupleEqual(last.args, ('x.0', 'x.0'))
 
 class SsaCheckerTest(LoggedTestCase):
     def test_example(self):
@@ -399,7 +811,7 @@ class SsaCheckerTest(LoggedTestCase):
         global_d2b = def2global_d2b(defs, global_names)
         dom_tree = DominatorTree(cfg1)
         insert_phi_functions(dom_tree, global_d2b)
-        rename_variables(cfg1, dom_tree, defs, global_names)
+        rename_variables(cfg1, dom_tree, defs)
         
         if not is_ssa(program):
             err = ValueError(f"Program is not in ssa form")
@@ -412,7 +824,7 @@ class SsaCheckerTest(LoggedTestCase):
         global_d2b = def2global_d2b(defs, global_names)
         dom_tree = DominatorTree(cfg2)
         insert_phi_functions(dom_tree, global_d2b)
-        rename_variables(cfg2, dom_tree, defs, global_names)
+        rename_variables(cfg2, dom_tree, defs)
         
         compare_ssa(cfg1, cfg2)
 
@@ -420,13 +832,11 @@ class SsaCheckerTest(LoggedTestCase):
             if hasattr(i, 'dest') and i.dest == a:
                 i.dest = b
             if hasattr(i, 'args') and i.args is not None:
-                for arg_idx in range(len(i.args)):
-                    if i.args[arg_idx] == a:
-                        i.args[arg_idx] = b
+                i.args = tuple(b if arg == a else arg for arg in i.args)
             
         # rename some variables in cfg2
         for bb in cfg2.blocks.values():
-            for i in bb.insts:
+            for i in bb.instructions():
                 rename_var(i, 'a.2', 'a.meow')
         
         compare_ssa(cfg1, cfg2)
@@ -442,13 +852,372 @@ class SsaCheckerTest(LoggedTestCase):
             defs, global_names, _ = collect_definitions(cfg)
             dom_tree = DominatorTree(cfg)
             insert_phi_functions(dom_tree, defs)
-            rename_variables(cfg, dom_tree, defs, global_names)
+            rename_variables(cfg, dom_tree, defs)
             func.instrs = reconstruct_instructions(cfg)
         
         json_output = serialize_bril(program)
         p = subprocess.Popen(["brili"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
         _ = p.communicate(input=json_output.encode())
 
+    def test_modes(self):
+        def run(program: Program) -> bytes:
+            p = subprocess.Popen(["brili"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            return p.communicate(input=serialize_bril(program).encode())[0]
+
+        golden = run(load_program())
+        counts = {}
+        for mode in SSA_MODES:
+            program = load_program()
+            counts[mode] = sum(construct_ssa(func, mode)[0] for func in program.functions)
+            self.assertTrue(is_ssa(program))
+            self.assertEqual(run(program), golden)
+        self.assertDictEqual(counts, { 'minimal': 19, 'semi-pruned': 11, 'pruned': 7 })
+        with self.assertRaises(ValueError):
+            construct_ssa(load_program().functions[0], 'maximal')
+
+    def test_remove_trivial_phis(self):
+        # c is a temporary of the loop header, y is read there before redefined
+        program = Program({ "functions": [{ "name": "main", "args": [{ "name": "n", "type": "int" }], "instrs": [
+            { "op": "const", "dest": "i", "type": "int", "value": 0 },
+            { "label": "head" },
+            { "op": "print", "args": ["y"] },
+            { "op": "lt", "dest": "c", "type": "bool", "args": ["i", "n"] },
+            { "op": "id", "dest": "y", "type": "int", "args": ["i"] },
+            { "op": "br", "args": ["c"], "labels": ["body", "exit"] },
+            { "label": "body" },
+            { "op": "add", "dest": "i", "type": "int", "args": ["i", "n"] },
+            { "op": "jmp", "labels": ["head"] },
+            { "label": "exit" },
+            { "op": "print", "args": ["i"] } ] }] })
+        n_phis, n_removed = construct_ssa(program.functions[0], remove_trivial=True)
+        self.assertTrue(is_ssa(program))
+        phis = [i for i in program.functions[0].instrs if i.op == SsaOpType.PHI]
+        self.assertEqual((n_phis, n_removed), (3, 1))
+        self.assertListEqual([phi.var for phi in phis], ['i', 'y'])
+
+        # phis at every join collapse to at most the minimal ones, same behavior
+        basic_tests = os.path.realpath(f"{script_dir}/../tests")
+        for bril_file in find_all_bril(basic_tests):
+            args = load_args(bril_file) or []
+            outputs, counts = [], []
+            for maximal in (False, True):
+                program = load_program(bril_file)
+                for func in program.functions:
+                    cfg = CFG(func)
+                    defs, global_names, _ = collect_definitions(cfg)
+                    dom_tree = DominatorTree(cfg)
+                    insert_phi_functions(dom_tree, defs)
+                    if maximal:
+                        for bb in cfg.blocks.values():
+                            if len(bb.preds) > 1:
+                                for var, (_, tp) in defs.items():
+                                    bb.insert_phi_if_not_exist_for(var, tp)
+                    rename_variables(cfg, dom_tree, defs)
+                    remove_trivial_phis(cfg, dom_tree)
+                    counts.append(sum(len(bb.phis) for bb in cfg.blocks.values()))
+                    func.instrs = reconstruct_instructions(cfg)
+                self.assertTrue(is_ssa(program))
+                p = subprocess.Popen(["brili", *args], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                outputs.append(p.communicate(input=serialize_bril(program).encode())[0])
+            self.assertEqual(outputs[0], outputs[1])
+            half = len(counts) // 2
+            self.assertListEqual(counts[half:], counts[:half])
+
+    def test_braun(self):
+        basic_tests = os.path.realpath(f"{script_dir}/../tests")
+        for bril_file in find_all_bril(basic_tests):
+            args = load_args(bril_file) or []
+            outputs = []
+            for engine in (None, construct_ssa_braun):
+                program = load_program(bril_file)
+                if engine is not None:
+                    for func in program.functions:
+                        n_phis, n_removed = engine(func)
+                        self.assertEqual(n_phis - n_removed,
+                                         sum(i.op == SsaOpType.PHI for i in func.instrs))
+                    self.assertTrue(is_ssa(program))
+                p = subprocess.Popen(["brili", *args], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                outputs.append(p.communicate(input=serialize_bril(program).encode())[0])
+            self.assertEqual(outputs[0], outputs[1])
+
+        # every use names a definition or an undefined value, no deep recursion
+        for program in (gen_program(300, seed=8), deep_program(20000)):
+            construct_ssa_braun(program.functions[0])
+            self.assertTrue(is_ssa(program))
+            instrs = program.functions[0].instrs
+            defined = set(i.dest for i in instrs if hasattr(i, 'dest'))
+            for i in instrs:
+                for arg in getattr(i, 'args', None) or []:
+                    self.assertTrue(arg in defined or arg.endswith(NullityType.UNDEFINED.name))
+
+        # unreachable cycles of single predecessors, entered from nowhere
+        for dead in (["dead"], ["dead", "dead2"]):
+            instrs = [{ "op": "const", "dest": "x", "type": "int", "value": 1 },
+                      { "op": "const", "dest": "c", "type": "bool", "value": True },
+                      { "op": "jmp", "labels": ["end"] }]
+            for n, label in enumerate(dead):
+                target = dead[(n + 1) % len(dead)]
+                instrs += [{ "label": label }, { "op": "br", "args": ["c"], "labels": [target, "end"] }]
+            instrs += [{ "label": "end" }, { "op": "print", "args": ["x"] }]
+            program = Program({ "functions": [{ "name": "main", "instrs": instrs }] })
+            construct_ssa_braun(program.functions[0])
+            self.assertTrue(is_ssa(program))
+            dead_br = next(i for i in program.functions[0].instrs if i.op == CtrlOpType.BR)
+            self.assertTupleEqual(dead_br.args, (f"c.{NullityType.UNDEFINED.name}",))
+
+    def test_liveness(self):
+        program = load_program()
+        cfg = CFG(program.functions[0])
+        live = Liveness(cfg)
+        for bb in cfg.blocks.values():
+            uses, defs = uses_and_defs(bb)
+            self.assertSetEqual(live.live_in_of(bb), uses | (live.live_out_of(bb) - defs))
+            self.assertSetEqual(live.live_out_of(bb), set().union(*(live.live_in_of(s) for s in bb.succs)))
+        self.assertSetEqual(live.live_in_of(cfg.entry_block), set())
+        self.assertTrue(live.live_in_of(cfg.blocks['b1']) <= set(('i', 'a', 'b', 'c', 'd')))
+
+        # SSA-aware: phi operands live out of their predecessor only
+        program = load_program()
+        construct_ssa(program.functions[0])
+        cfg = CFG(program.functions[0])
+        live = Liveness(cfg, ssa=True)
+        for bb in cfg.blocks.values():
+            for phi in bb.get_by_op(SsaOpType.PHI):
+                self.assertIn(phi.dest, live.live_in_of(bb))
+                for label, arg in phi.operands.items():
+                    self.assertIn(arg, live.live_out_of(cfg.blocks[label]))
+            for s in bb.succs:
+                self.assertFalse(live.live_out_of(bb) & set(phi.dest for phi in s.get_by_op(SsaOpType.PHI)))
+        # in SSA, a live-in value is defined by a dominating block
+        dom_tree = DominatorTree(cfg)
+        def_block = {}
+        for bb in cfg.blocks.values():
+            for i in bb.insts:
+                if hasattr(i, 'dest'):
+                    def_block[i.dest] = bb
+        for bb in cfg.blocks.values():
+            for var in live.live_in_of(bb):
+                if var in def_block and def_block[var] is not bb:
+                    self.assertTrue(dom_tree.dominates(def_block[var], bb))
+
+    def test_var_index(self):
+        var_index = VarIndex()
+        ids = [var_index.intern(name) for name in ('x', 'y', 'z', 'x')]
+        self.assertListEqual(ids, [0, 1, 2, 0])
+        for names in ((), ('x',), ('z', 'x'), ('x', 'y', 'z', 'w')):
+            bits = var_index.bits_of(names)
+            self.assertEqual(bits, bits_of(var_index.ids[n] for n in names if n in var_index))
+            self.assertSetEqual(var_index.names_of(bits), set(n for n in names if n in var_index))
+
+    def test_liveness_generated(self):
+        cfg = CFG(gen_program(2000, seed=7).functions[0])
+        live = Liveness(cfg)
+        for bb in cfg.blocks.values():
+            uses, defs = uses_and_defs(bb)
+            live_out = live.live_out_of(bb)
+            self.assertSetEqual(live_out, set().union(*(live.live_in_of(s) for s in bb.succs)))
+            self.assertSetEqual(live.live_in_of(bb), uses | (live_out - defs))
+
+class SsaDestructTest(LoggedTestCase):
+    def test_sequentialize(self):
+        rnd = random.Random(0)
+        names = [f"r{n}" for n in range(6)]
+        for _ in range(200):
+            dests = rnd.sample(names, rnd.randrange(len(names) + 1))
+            copies = [(d, rnd.choice(names)) for d in dests]
+            temps = NameGenerator(names)
+            seq = sequentialize(copies, lambda d: temps.new_name('t'))
+            # run in order, the dests must get the old values of the sources
+            env = { n: n for n in names }
+            for d, s in seq:
+                env[d] = env[s]
+            self.assertDictEqual({ d: env[d] for d, _ in copies }, dict(copies))
+            # one temporary per cycle at most
+            self.assertLessEqual(len(seq), len(copies) + len(copies) // 2)
+
+        # a swap needs a temporary
+        seq = sequentialize([('a', 'b'), ('b', 'a')], lambda d: f"{d}.tmp")
+        self.assertListEqual(seq, [('a.tmp', 'a'), ('a', 'b'), ('b', 'a.tmp')])
+
+    def test_swap_cycle(self):
+        # a and b swap in the loop, e.g. after copy propagation
+        program = Program({ "functions": [{ "name": "main", "instrs": [
+            { "label": "entry" },
+            { "op": "const", "dest": "a.0", "type": "int", "value": 1 },
+            { "op": "const", "dest": "b.0", "type": "int", "value": 2 },
+            { "op": "const", "dest": "i.0", "type": "int", "value": 0 },
+            { "op": "const", "dest": "n.0", "type": "int", "value": 3 },
+            { "op": "const", "dest": "one.0", "type": "int", "value": 1 },
+            { "op": "jmp", "labels": ["head"] },
+            { "label": "head" },
+            { "op": "phi", "dest": "a.1", "type": "int", "args": ["a.0", "b.1"], "labels": ["entry", "body"] },
+            { "op": "phi", "dest": "b.1", "type": "int", "args": ["b.0", "a.1"], "labels": ["entry", "body"] },
+            { "op": "phi", "dest": "i.1", "type": "int", "args": ["i.0", "i.2"], "labels": ["entry", "body"] },
+            { "op": "lt", "dest": "c.0", "type": "bool", "args": ["i.1", "n.0"] },
+            { "op": "br", "args": ["c.0"], "labels": ["body", "exit"] },
+            { "label": "body" },
+            { "op": "add", "dest": "i.2", "type": "int", "args": ["i.1", "one.0"] },
+            { "op": "jmp", "labels": ["head"] },
+            { "label": "exit" },
+            { "op": "print", "args": ["a.1", "b.1"] } ] }] })
+        self.assertEqual(destruct_ssa(program.functions[0]), 3)
+        # phis of a block are parallel, three swaps, unlike brili running them in order
+        p = subprocess.Popen(["brili"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.assertEqual(p.communicate(input=serialize_bril(program).encode())[0], b"2 1\n")
+        instrs = program.functions[0].instrs
+        self.assertFalse(any(i.op == SsaOpType.PHI for i in instrs))
+        # a and b can't share a name, the loop counter needs no copy
+        copies = [(i.dest, i.args[0]) for i in instrs if getattr(i, 'op', None) == TrivialOpType.ID]
+        self.assertListEqual(copies, [('a.0.tmp1', 'a.0'), ('a.0', 'b.0'), ('b.0', 'a.0.tmp1')])
+
+    def test_round_trip(self):
+        basic_tests = os.path.realpath(f"{script_dir}/../tests")
+        for bril_file in find_all_bril(basic_tests):
+            args = load_args(bril_file) or []
+            def run(program: Program) -> bytes:
+                p = subprocess.Popen(["brili", *args], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                return p.communicate(input=serialize_bril(program).encode())[0]
+
+            golden = run(load_program(bril_file))
+            for engine in (construct_ssa, construct_ssa_braun):
+                counts = []
+                for coalesce in (False, True):
+                    program = load_program(bril_file)
+                    for func in program.functions:
+                        engine(func)
+                        counts.append(destruct_ssa(func, coalesce))
+                        self.assertFalse(any(i.op == SsaOpType.PHI for i in func.instrs))
+                    self.assertEqual(run(program), golden)
+                # freshly constructed SSA is conventional, every copy coalesces
+                self.assertListEqual(counts[len(counts) // 2:], [0] * (len(counts) // 2))
+
+class ColumnarTest(LoggedTestCase):
+    def programs(self) -> list[dict]:
+        basic_tests = os.path.realpath(f"{script_dir}/../tests")
+        programs = [load_program(bril_file).to_dict() for bril_file in find_all_bril(basic_tests)]
+        programs.append(gen_program(150, seed=3).to_dict())
+        programs.append(deep_program(300).to_dict())
+        return programs
+
+    def test_convert(self):
+        for prog in self.programs():
+            for func in prog['functions']:
+                function = Function(json.loads(json.dumps(func)))
+                self.assertDictEqual(ColumnarFunction.from_dict(func).to_dict(), function.to_dict())
+                self.assertDictEqual(ColumnarFunction.from_function(function).to_dict(), function.to_dict())
+                self.assertDictEqual(ColumnarFunction.from_dict(func).to_function().to_dict(), function.to_dict())
+        with self.assertRaises(ValueError):
+            ColumnarFunction.from_dict({ "name": "f", "instrs": [{ "op": "add", "dest": "x" }] })
+
+    def test_cfg(self):
+        for prog in self.programs():
+            for func in prog['functions']:
+                index = CFG(Function(json.loads(json.dumps(func)))).index
+                columnar_index = ColumnarCfg(ColumnarFunction.from_dict(func)).index
+                self.assertListEqual([bb.label for bb in columnar_index.blocks], [bb.label for bb in index.blocks])
+                self.assertEqual(columnar_index.succ_idx, index.succ_idx)
+                self.assertEqual(columnar_index.pred_idx, index.pred_idx)
+
+    def test_construct_ssa(self):
+        for prog in self.programs():
+            for mode in SSA_MODES:
+                for func in prog['functions']:
+                    function = Function(json.loads(json.dumps(func)))
+                    n_phis, _ = construct_ssa(function, mode)
+                    cf = ColumnarFunction.from_dict(json.loads(json.dumps(func)))
+                    self.assertEqual(columnar.construct_ssa(cf, mode), n_phis)
+                    self.assertDictEqual(cf.to_dict(), function.to_dict())
+
+class DriverTest(LoggedTestCase):
+    def test_jobs(self):
+        funcs = []
+        for n in range(6):
+            func = gen_program(50 * (n + 1), seed=n).to_dict()['functions'][0]
+            func['name'] = f"f{n}"
+            funcs.append(func)
+        for engine in ('cytron', 'braun'):
+            args = argparse.Namespace(engine=engine, mode='pruned', remove_trivial_phis=True,
+                                      out_of_ssa=True, no_coalesce=False, stats=False, ir='objects')
+            serial = driver.transform_functions(funcs, args)
+            self.assertListEqual([func['name'] for func, _ in serial], [f"f{n}" for n in range(6)])
+            # small programs stay serial unless forced
+            min_instrs = driver.PARALLEL_MIN_INSTRS
+            try:
+                driver.PARALLEL_MIN_INSTRS = 0
+                self.assertListEqual(driver.transform_functions(funcs, args, jobs=3), serial)
+            finally:
+                driver.PARALLEL_MIN_INSTRS = min_instrs
+
+    def test_batch(self):
+        args = argparse.Namespace(engine='cytron', mode='minimal', remove_trivial_phis=False,
+                                  out_of_ssa=False, no_coalesce=False, stats=False, ir='objects')
+        program = load_program()
+        golden = driver.transform_program(program.to_dict(), args)
+        lines = [json.dumps(program.to_dict()),
+                 "",
+                 '{ "functions": [{ "name": "f", "instrs": [{ "op": "jmp", "labels": ["nowhere"] }] }] }',
+                 example_path,
+                 f"{script_dir}/no-such-program.json"]
+        out = io.StringIO()
+        self.assertEqual(driver.run_batch(lines, args, 1, out), (4, 3))
+        results = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(results), 4)
+        self.assertDictEqual(results[0], golden)
+        self.assertIn('error', results[1])
+        # a .bril path is not JSON, the batch goes on
+        self.assertIn('error', results[2])
+        self.assertIn('error', results[3])
+
+        # a parallel batch starts a single pool for all its programs
+        funcs = []
+        for n in range(3):
+            func = gen_program(20 * (n + 1), seed=n).to_dict()['functions'][0]
+            func['name'] = f"f{n}"
+            funcs.append(func)
+        line = json.dumps({ "functions": funcs })
+        golden = driver.transform_program(json.loads(line), args)
+        pools = []
+        class CountedPool(driver.ProcessPoolExecutor):
+            def __init__(self, *args, **kwargs):
+                pools.append(self)
+                super().__init__(*args, **kwargs)
+        min_instrs, pool_class = driver.PARALLEL_MIN_INSTRS, driver.ProcessPoolExecutor
+        try:
+            driver.PARALLEL_MIN_INSTRS, driver.ProcessPoolExecutor = 0, CountedPool
+            out = io.StringIO()
+            self.assertEqual(driver.run_batch([line] * 3, args, 2, out), (3, 0))
+        finally:
+            driver.PARALLEL_MIN_INSTRS, driver.ProcessPoolExecutor = min_instrs, pool_class
+        self.assertEqual(len(pools), 1)
+        for line in out.getvalue().splitlines():
+            self.assertDictEqual(json.loads(line), golden)
+
+    def test_stream(self):
+        funcs = []
+        for n in range(4):
+            func = gen_program(30 * (n + 1), seed=n).to_dict()['functions'][0]
+            func['name'] = f"f{n}"
+            funcs.append(func)
+        text = json.dumps({ "functions": funcs }, indent=2)
+        for chunk_size in (1, 7, 1 << 16):
+            self.assertListEqual(list(bril.FunctionReader(io.StringIO(text), chunk_size)), funcs)
+        with self.assertRaises(ValueError):
+            list(bril.FunctionReader(io.StringIO('{ "functions": [{}, ] }')))
+        orjson = bril.orjson
+        try:
+            # without orjson, compact output is written by Function.write_json
+            for backend, compact in ((orjson, False), (orjson, True), (None, True)):
+                bril.orjson = backend
+                args = argparse.Namespace(engine='braun', mode='minimal', remove_trivial_phis=False, out_of_ssa=True,
+                                          no_coalesce=False, stats=False, ir='objects', compact=compact)
+                for program in ({ "functions": funcs }, { "functions": [] }):
+                    out = io.StringIO()
+                    driver.run_stream(io.StringIO(json.dumps(program)), args, out)
+                    golden = driver.transform_program(json.loads(json.dumps(program)), args)
+                    self.assertEqual(out.getvalue(), bril.dumps_json(golden, compact))
+        finally:
+            bril.orjson = orjson
+
 class IntegrationTest(LoggedTestCase):
     def test_advanced_integration(self):
         advanced_tests = os.path.realpath(f"{script_dir}/../bril/examples/test")
@@ -469,9 +1238,9 @@ class GradeTest(LoggedTestCase):
                 logger.warn(res.stdout.decode())
             
 if __name__ == '__main__':
-    cases = (LoggerTest, BasicBlockTest, InstTest,
-             CfgTest, DomTest, SsaTest,
-             SsaCheckerTest,
+    cases = (LoggerTest, SerializeTest, BasicBlockTest, InstTest,
+             CfgTest, DomTest, DomBackendTest, DynamicDomTest, DataflowTest, SsaTest,
+             SsaCheckerTest, SsaDestructTest, ColumnarTest, DriverTest,
              IntegrationTest,
              GradeTest)
     suites = TestSuite(defaultTestLoader.loadTestsFromTestCase(t)
@@ -0,0 +1,209 @@
+from bril import Function, Phi
+from cfg import CFG, BasicBlock
+from instruction.common import ValType
+from instruction.value import NullityType
+from logger.logger import logger
+from ssa_construct import reconstruct_instructions
+from util import NameGenerator
+
+class BraunSsaBuilder:
+    """On-the-fly SSA construction of Braun et al., without dominance
+
+    Blocks are filled in the order of `cfg.blocks`. Reading a variable not
+    defined in the current block looks it up through the predecessors,
+    placing a phi where they merge. An unsealed block, some predecessor
+    not filled yet, gets an incomplete phi completed once it is sealed.
+    Trivial phis are removed as soon as their operands are known.
+
+    Chains of single predecessors are walked with a loop and phi operands
+    are filled from a work stack, so deep CFGs need no deep recursion.
+    """
+
+    def __init__(self, cfg: CFG):
+        self.cfg = cfg
+        self.sep = '.'
+        self.position = { label: n for n, label in enumerate(cfg.blocks) }
+        """position of each block label, to order predecessors deterministically
+        """
+        self.types: dict[str, ValType] = {}
+        """type of each variable defined in the function
+        """
+        for arg in cfg.function.args:
+            self.types[arg['name']] = ValType.find(arg['type'])
+        for bb in cfg.blocks.values():
+            for i in bb.insts:
+                if getattr(i, 'dest', None) is not None:
+                    self.types.setdefault(i.dest, i.type)
+        self.names = NameGenerator(self.types)
+        self.current_def: dict[str, dict[BasicBlock, str]] = {}
+        """value of each variable at the end of each block visited so far
+        """
+        self.sealed: set[BasicBlock] = set()
+        self.filled: set[BasicBlock] = set()
+        self.incomplete: dict[BasicBlock, list[Phi]] = {}
+        """phis placed in unsealed blocks, waiting for their operands
+        """
+        self.pending: list[tuple[Phi, BasicBlock]] = []
+        """phis whose operands are to be filled
+        """
+        self.replaced: dict[str, str] = {}
+        """value each removed phi is replaced by
+        """
+        self.phi_users: dict[str, list[tuple[Phi, BasicBlock]]] = {}
+        """phis reading each value
+        """
+        self.n_phis = 0
+        self.n_removed = 0
+
+    def resolve(self, value: str) -> str:
+        """Follow the replacements of removed phis from `value`
+        """
+        root = value
+        while root in self.replaced:
+            root = self.replaced[root]
+        while value != root:  # path compression
+            self.replaced[value], value = root, self.replaced[value]
+        return root
+
+    def preds_of(self, bb: BasicBlock) -> list[BasicBlock]:
+        return sorted(bb.preds, key=lambda p: self.position[p.label])
+
+    def new_phi(self, var: str, bb: BasicBlock) -> Phi:
+        bb.insert_phi_if_not_exist_for(var, self.types[var])
+        phi = bb.phis[var]
+        phi.dest = self.names.new_name(f"{var}{self.sep}", 0)
+        self.n_phis += 1
+        return phi
+
+    def write_variable(self, var: str, bb: BasicBlock, value: str):
+        self.current_def.setdefault(var, {})[bb] = value
+
+    def read_variable(self, var: str, bb: BasicBlock) -> str:
+        """Value of `var` at the end of `bb`, or on its entry if `bb` is being filled
+        """
+        value = self._lookup(var, bb)
+        self._fill_pending()
+        return self.resolve(value)
+
+    def _lookup(self, var: str, bb: BasicBlock) -> str:
+        defs = self.current_def.setdefault(var, {})
+        chain: list[BasicBlock] = []
+        on_chain: set[BasicBlock] = set()
+        while bb not in defs:
+            if var not in self.types:  # never defined
+                defs[bb] = f"{var}{self.sep}{NullityType.UNDEFINED.name}"
+            elif bb not in self.sealed:
+                phi = self.new_phi(var, bb)
+                self.incomplete.setdefault(bb, []).append(phi)
+                defs[bb] = phi.dest
+            elif len(bb.preds) == 0:
+                defs[bb] = f"{var}{self.sep}{NullityType.UNDEFINED.name}"
+            elif bb in on_chain:
+                # a cycle of single predecessors is entered from nowhere, so unreachable
+                defs[bb] = f"{var}{self.sep}{NullityType.UNDEFINED.name}"
+            elif len(bb.preds) == 1:
+                chain.append(bb)
+                on_chain.add(bb)
+                bb = next(iter(bb.preds))
+            else:
+                # the phi breaks cycles, its operands are looked up later
+                phi = self.new_phi(var, bb)
+                defs[bb] = phi.dest
+                self.pending.append((phi, bb))
+        value = defs[bb]
+        for c in chain:
+            defs[c] = value
+        return value
+
+    def _fill_pending(self):
+        while len(self.pending) > 0:
+            phi, bb = self.pending.pop()
+            for p in self.preds_of(bb):
+                value = self._lookup(phi.var, p)
+                phi.operands[p.label] = value
+                self.phi_users.setdefault(value, []).append((phi, bb))
+            self._try_remove_trivial(phi, bb)
+
+    def _try_remove_trivial(self, phi: Phi, bb: BasicBlock):
+        work = [(phi, bb)]
+        while len(work) > 0:
+            phi, bb = work.pop()
+            if bb.phis.get(phi.var) is not phi or phi.dest in self.replaced:
+                continue
+            same = None
+            for op in map(self.resolve, phi.operands.values()):
+                if op == same or op == phi.dest:
+                    continue
+                if same is not None:
+                    break
+                same = op
+            else:
+                if same is None:  # unreachable or only reads itself
+                    same = f"{phi.var}{self.sep}{NullityType.UNDEFINED.name}"
+                del bb.phis[phi.var]
+                self.replaced[phi.dest] = same
+                self.n_removed += 1
+                for user in self.phi_users.pop(phi.dest, []):
+                    if user[0] is not phi:
+                        self.phi_users.setdefault(same, []).append(user)
+                        work.append(user)
+
+    def seal_block(self, bb: BasicBlock):
+        """All predecessors of `bb` are filled, complete its phis
+        """
+        self.sealed.add(bb)
+        for phi in self.incomplete.pop(bb, []):
+            self.pending.append((phi, bb))
+        self._fill_pending()
+
+    def fill_block(self, bb: BasicBlock):
+        """Rename the uses and definitions of `bb`, then seal the successors ready
+        """
+        for i in bb.insts:
+            if getattr(i, 'args', None) is not None:
+                i.args = tuple(self.read_variable(arg, bb) for arg in i.args)
+            if getattr(i, 'dest', None) is not None:
+                var = i.dest
+                i.dest = self.names.new_name(f"{var}{self.sep}", 0)
+                self.write_variable(var, bb, i.dest)
+        self.filled.add(bb)
+        for s in sorted(bb.succs, key=lambda s: self.position[s.label]):
+            if s not in self.sealed and all(p in self.filled for p in s.preds):
+                self.seal_block(s)
+
+    def build(self):
+        entry = self.cfg.entry_block
+        self.seal_block(entry)
+        for arg in self.cfg.function.args:
+            var = arg['name']
+            arg['name'] = self.names.new_name(f"{var}{self.sep}", 0)
+            self.write_variable(var, entry, arg['name'])
+        for bb in self.cfg.blocks.values():
+            if len(bb.preds) == 0 and bb not in self.sealed:
+                self.seal_block(bb)
+            self.fill_block(bb)
+        for bb in self.cfg.blocks.values():
+            if bb not in self.sealed:
+                err = ValueError(f"Block {bb} is never sealed")
+                logger.error(err)
+                raise err
+        # uses read before a phi was removed still name it
+        for bb in self.cfg.blocks.values():
+            for phi in bb.phis.values():
+                phi.operands = { label: self.resolve(arg) for label, arg in phi.operands.items() }
+            for i in bb.insts:
+                if getattr(i, 'args', None) is not None:
+                    i.args = tuple(self.resolve(arg) for arg in i.args)
+
+def construct_ssa_braun(function: Function) -> tuple[int, int]:
+    """
+    Transforms the function into SSA form on the fly, without dominance.
+
+    Returns:
+        tuple[int, int]: numbers of phi functions inserted and removed
+    """
+    cfg = CFG(function)
+    builder = BraunSsaBuilder(cfg)
+    builder.build()
+    function.instrs = reconstruct_instructions(cfg)
+    return builder.n_phis, builder.n_removed
@@ -1,33 +1,62 @@
-from collections import deque
-from bril import Const, Function, Instruction, Label, ValueOperation
+from typing import Optional
+from bril import Const, EffectOperation, Function, Instruction, Label, Phi, ValueOperation
 from cfg import CFG, BasicBlock
 from instruction.value import NullityType
 from instruction.common import ValType
 from instruction.ssa import SsaOpType
-from util import new_name
+from util import NameGenerator, iter_bits
 from logger.logger import logger
 from dominance import DominatorTree
+from liveness import Liveness
 
-def construct_ssa(function: Function):
+SSA_MODES = ('minimal', 'semi-pruned', 'pruned')
+"""Phi placement modes of `construct_ssa`
+
+* `minimal`: a phi at every iterated dominance frontier of each definition
+* `semi-pruned`: only for variables used across blocks (`global_names`)
+* `pruned`: only where the variable is live on entry
+"""
+
+def construct_ssa(function: Function,
+                  mode: str = 'minimal',
+                  remove_trivial: bool = False) -> tuple[int, int]:
     """
     Transforms the function into SSA form.
+
+    Args:
+        mode (str, optional): phi placement mode in `SSA_MODES`. Defaults to `minimal`.
+        remove_trivial (bool, optional): whether to remove trivial phi functions
+            after renaming, see `remove_trivial_phis`. Defaults to `False`.
+
+    Returns:
+        tuple[int, int]: numbers of phi functions inserted and removed
     """
+    if mode not in SSA_MODES:
+        err = ValueError(f"Invalid SSA mode {mode}, should be one of {SSA_MODES}")
+        logger.error(err)
+        raise err
+
     cfg = CFG(function)
     dom_tree = DominatorTree(cfg)
 
     # Step 1: Variable Definition Analysis
     defs, global_names, _ = collect_definitions(cfg)
-    # global_d2b = def2global_d2b(defs, global_names)
 
     # Step 2: Insert φ-Functions
-    # insert_phi_functions(dom_tree, global_d2b)
-    insert_phi_functions(dom_tree, defs)
+    if mode == 'minimal':
+        n_phis = insert_phi_functions(dom_tree, defs)
+    elif mode == 'semi-pruned':
+        n_phis = insert_phi_functions(dom_tree, def2global_d2b(defs, global_names))
+    else:
+        n_phis = insert_phi_functions(dom_tree, def2global_d2b(defs, global_names), live=Liveness(cfg))
 
     # Step 3: Rename Variables
-    rename_variables(cfg, dom_tree, defs, global_names)
+    rename_variables(cfg, dom_tree, defs)
+    n_removed = remove_trivial_phis(cfg, dom_tree) if remove_trivial else 0
 
     # After transformation, update the function's instructions
     function.instrs = reconstruct_instructions(cfg)
+    return n_phis, n_removed
 
 def collect_definitions(cfg: CFG):
     """
@@ -50,12 +79,12 @@ def collect_definitions(cfg: CFG):
     
     for label, bb in cfg.blocks.items():
         for inst in bb.insts:
+            if (isinstance(inst, (ValueOperation, EffectOperation))
+                and inst.args is not None):
+                for arg in inst.args:
+                    if arg not in val_kill.setdefault(label, set()):
+                        global_names.add(arg)
             if isinstance(inst, (Const, ValueOperation)):
-                if (isinstance(inst, ValueOperation)
-                    and inst.args is not None):
-                    for arg in inst.args:
-                        if arg not in val_kill.setdefault(label, set()):
-                            global_names.add(arg)
                 val_kill.setdefault(label, set()).add(inst.dest)
                 defs.setdefault(inst.dest, (set(), inst.type))[0].add(bb)
                 
@@ -75,89 +104,181 @@ def def2global_d2b(defs: dict[str, tuple[set[BasicBlock], ValType]],
     return { k: v for k, v in defs.items() if k in global_names }
 
 def insert_phi_functions(dom_tree: DominatorTree,
-                         global_d2b: dict[str, tuple[set[BasicBlock], ValType]]):
+                         global_d2b: dict[str, tuple[set[BasicBlock], ValType]],
+                         idf_engine: str = 'merge',
+                         live: Optional[Liveness] = None) -> int:
     """
     Inserts φ-functions into the basic defs.
+
+    Args:
+        idf_engine (str, optional): iterated dominance frontier engine,
+            see `DominatorTree.iterated_frontier_bits`. Defaults to `merge`.
+        live (Liveness, optional): pre-SSA liveness of the function,
+            if given, phis are only placed where the variable is live on entry
+
+    Returns:
+        int: number of phi functions inserted
     """
     # TODO: Implement φ-function insertion using dominance frontiers
+    index = dom_tree.index
+    n_phis = 0
     for var, (def_blocks, def_type) in global_d2b.items():
-        q = deque(def_blocks)
-        while len(q) > 0:
-            b = q.popleft()
-            for df in dom_tree.dom_frontiers[b]:
-                if df.insert_phi_if_not_exist_for(var, def_type):
-                    q.append(df)
+        idf = dom_tree.iterated_frontier_bits(index.bits_of(def_blocks), idf_engine)
+        for b in iter_bits(idf):
+            if live is not None and not live.is_live_in(var, b):
+                continue
+            if index.blocks[b].insert_phi_if_not_exist_for(var, def_type):
+                n_phis += 1
+    return n_phis
 
 def rename_variables(cfg: CFG,
                      dom_tree: DominatorTree,
                      defs: dict[str,
-                     set[BasicBlock]],
-                     global_names: set[str]):
+                     set[BasicBlock]]):
     """
     Renames variables to ensure each assignment is unique.
     """
     # TODO: Implement variable renaming
-    names = set(defs)
-    rename_stacks: dict[str, list[int]] = {}
+    names = NameGenerator(defs)
+    for arg in cfg.function.args:
+        names.take(arg['name'])
+    rename_stacks: dict[str, list[str]] = {}
     sep = '.'
 
-    def rename(var: str):
-        renamed_var = new_name(f"{var}{sep}", names, 0)
-        names.add(renamed_var)
+    def rename(var: str, pushed: list[str]):
+        """Push a fresh name for `var`, recording `var` in undo log `pushed`
+        """
+        renamed_var = names.new_name(f"{var}{sep}", 0)
         rename_stacks.setdefault(var, []).append(renamed_var)
+        pushed.append(var)
         return renamed_var
     
-    def scan_and_rename(bb: BasicBlock):
-        # Snapshot current stack for restoration
-        # at the end of this recursive function
-        snapshot = { k: list(v) for k, v in rename_stacks.items() }
+    index = dom_tree.index
+
+    def scan_and_rename(b: int) -> list[str]:
+        """Rename the definitions and uses in block index `b`
+        and the phi operands it feeds
+
+        Returns:
+            list[str]: variables pushed in this block, to be popped
+                once the blocks it dominates are renamed
+        """
+        bb = index.blocks[b]
+        pushed: list[str] = []
 
         # Rename dest of phis
-        for phi in bb.get_by_op(SsaOpType.PHI):
-            phi.dest = rename(phi.dest)
+        for phi in bb.ordered_phis():
+            phi.dest = rename(phi.var, pushed)
 
         # Rename all the variables in the successor renamed in this BB
-        local_defs: set[str] = set()  # local definition of the successor
         for i in bb.insts:
             if i.op != SsaOpType.PHI:
                 if hasattr(i, 'args') and i.args is not None:
-                    i.args = [rename_stacks[arg][-1] if arg in rename_stacks else arg
-                              for arg in i.args]
+                    i.args = tuple(rename_stacks[arg][-1] if arg in rename_stacks else arg
+                                   for arg in i.args)
                 if hasattr(i, 'dest') and i.dest is not None:
-                    if i.dest in global_names or i.dest in local_defs or sep not in i.dest:
-                        i.dest = rename(i.dest)
-                    local_defs.add(i.dest)
+                    i.dest = rename(i.dest, pushed)
 
         # rename phi arguments in successor
-        for sbb in bb.succs:
-            for i in sbb.insts:
-                if i.op == SsaOpType.PHI:
-                    if not isinstance(i.dest, str):
-                        err = ValueError(f"Invalid destination for inst {i}")
-                        logger.error(err)
-                        raise err
-                    dot = i.dest.split(sep)
-                    var = sep.join(dot if len(dot) == 1 else dot[:-1])
-                    if var in rename_stacks:
-                        i.args.append(rename_stacks[var][-1])
-                    else:
-                        i.args.append(f"{var}.{NullityType.UNDEFINED.name}")
-                    # Add corresponding label
-                    i.labels.append(bb.label)
+        for s in index.succs(b):
+            for var, phi in index.blocks[s].phis.items():
+                if var in rename_stacks:
+                    phi.operands[bb.label] = rename_stacks[var][-1]
+                else:
+                    phi.operands[bb.label] = f"{var}.{NullityType.UNDEFINED.name}"
                     
-        # Recursive rename based on the dominator tree
-        for sbb in dom_tree.children.get(bb.label, []):
-            scan_and_rename(sbb)
-
-        # Restore stack state
-        rename_stacks.clear()
-        rename_stacks.update(snapshot)
+        return pushed
 
-    # Include function arguments
+    # Include function arguments, never popped
     for arg in cfg.function.args:
-        arg['name'] = rename(arg['name'])
-    # Start recursive rename
-    scan_and_rename(cfg.entry_block)
+        arg['name'] = rename(arg['name'], [])
+    # Walk the dominator tree from the entry block
+    undo_logs: list[list[str]] = []
+    for b, entering in dom_tree.walk():
+        if entering:
+            undo_logs.append(scan_and_rename(b))
+        else:
+            # Restore stack state
+            for var in reversed(undo_logs.pop()):
+                stack = rename_stacks[var]
+                stack.pop()
+                if len(stack) == 0:
+                    del rename_stacks[var]
+
+def remove_trivial_phis(cfg: CFG, dom_tree: DominatorTree) -> int:
+    """Remove phi functions merging a single value, to a fixpoint (Braun et al.)
+
+    A phi is trivial if its operands other than itself are all one value `v`,
+    its uses are then rewritten to `v`. An undefined operand is ignored only
+    if the definition of `v` dominates the phi and no instruction of the phi
+    block reads the phi before `v` is defined, so every use stays dominated.
+    Removing a phi may make the phis using it trivial, those are checked again.
+
+    Returns:
+        int: number of phi functions removed
+    """
+    index = dom_tree.index
+    entry = index.blocks[0]
+    def_block: dict[str, BasicBlock] = { arg['name']: entry for arg in cfg.function.args }
+    users: dict[str, list[Instruction]] = {}
+    for bb in index.blocks:
+        for phi in bb.phis.values():
+            def_block[phi.dest] = bb
+            for arg in phi.operands.values():
+                users.setdefault(arg, []).append(phi)
+        for i in bb.insts:
+            if getattr(i, 'args', None) is not None:
+                for arg in i.args:
+                    users.setdefault(arg, []).append(i)
+            if getattr(i, 'dest', None) is not None:
+                def_block[i.dest] = bb
+    phi_block = { id(phi): bb for bb in index.blocks for phi in bb.phis.values() }
+
+    def trivial_value(phi: Phi, bb: BasicBlock) -> Optional[str]:
+        undefined = f"{phi.var}.{NullityType.UNDEFINED.name}"
+        values = set(phi.operands.values())
+        values.discard(phi.dest)
+        has_undefined = undefined in values
+        values.discard(undefined)
+        if len(values) != 1:
+            return None
+        v = next(iter(values))
+        if has_undefined:
+            d = def_block.get(v)
+            if d is None or not dom_tree.dominates(d, bb):
+                return None
+            # `v` defined later in this block can't replace reads before it
+            if d is bb and any(not isinstance(u, Phi) and any(u is i for i in bb.insts)
+                               for u in users.get(phi.dest, [])):
+                return None
+        return v
+
+    n_removed = 0
+    work = [phi for bb in index.blocks for phi in bb.phis.values()]
+    work.reverse()
+    while len(work) > 0:
+        phi = work.pop()
+        bb = phi_block.get(id(phi))
+        if bb is None:  # removed already
+            continue
+        v = trivial_value(phi, bb)
+        if v is None:
+            continue
+        del bb.phis[phi.var]
+        del phi_block[id(phi)]
+        n_removed += 1
+        # rewrite the uses of the phi, its phi users may become trivial
+        for user in users.pop(phi.dest, []):
+            if user is phi:
+                continue
+            if isinstance(user, Phi):
+                user.operands = { label: v if arg == phi.dest else arg
+                                  for label, arg in user.operands.items() }
+                work.append(user)
+            else:
+                user.args = tuple(v if arg == phi.dest else arg for arg in user.args)
+            users.setdefault(v, []).append(user)
+    return n_removed
 
 def reconstruct_instructions(cfg: CFG) -> list[Instruction]:
     """
@@ -167,5 +288,5 @@ def reconstruct_instructions(cfg: CFG) -> list[Instruction]:
     insts = []
     for label, block in cfg.blocks.items():
         insts.append(Label({ "label": label }))
-        insts.extend(block.insts)
+        insts.extend(block.instructions())
     return insts
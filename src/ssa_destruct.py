@@ -0,0 +1,369 @@
+import heapq
+from collections import OrderedDict
+from typing import Callable
+from bril import Const, EffectOperation, Function, Phi, ValueOperation
+from cfg import CFG, BasicBlock
+from instruction.common import ValType
+from instruction.const import ConstOpType
+from instruction.control import CtrlOpType
+from instruction.ssa import SsaOpType
+from instruction.trivial import TrivialOpType
+from instruction.value import CoreValType
+from dominance import DominatorTree
+from liveness import Liveness
+from ssa_construct import reconstruct_instructions
+from util import NameGenerator
+
+def destruct_ssa(function: Function, coalesce: bool = True) -> int:
+    """
+    Transforms the function out of SSA form.
+
+    Phi functions are lowered to parallel copies at the end of their
+    predecessors, splitting the critical edges that need copies.
+    Names related by phis are coalesced unless they interfere,
+    so their copies disappear. Copies are sequentialized into `id`
+    instructions, swap cycles go through a fresh temporary.
+
+    Args:
+        coalesce (bool, optional): whether to coalesce phi related names. Defaults to `True`.
+
+    Returns:
+        int: number of copies inserted
+    """
+    cfg = CFG(function)
+    defined = set(arg['name'] for arg in function.args)
+    for bb in cfg.blocks.values():
+        for i in bb.insts:
+            if getattr(i, 'dest', None) is not None:
+                defined.add(i.dest)
+
+    # Step 1: Split the critical edges carrying copies
+    split_critical_edges(cfg, defined)
+
+    # Step 2: Coalesce names whose live ranges don't interfere
+    rep = PhiCoalescer(cfg).coalesce() if coalesce else {}
+    def find(var: str) -> str:
+        return rep.get(var, var)
+    for arg in function.args:
+        arg['name'] = find(arg['name'])
+
+    # Step 3: Lower phis to sequentialized parallel copies
+    phis = { bb: bb.get_by_op(SsaOpType.PHI) for bb in cfg.blocks.values() }
+    names = NameGenerator(defined)
+    n_copies = 0
+    for bb in cfg.blocks.values():
+        bb.phis = {}
+        body = []
+        for i in bb.insts:
+            if i.op == SsaOpType.PHI:
+                continue
+            if getattr(i, 'args', None) is not None:
+                i.args = tuple(find(arg) for arg in i.args)
+            if getattr(i, 'dest', None) is not None:
+                i.dest = find(i.dest)
+                if i.op == TrivialOpType.ID and i.args == (i.dest,):
+                    continue  # copy coalesced away
+            body.append(i)
+        bb.insts = body
+    for bb, bb_phis in phis.items():
+        if len(bb_phis) == 0:
+            continue
+        types = { find(phi.dest): phi.type for phi in bb_phis }
+        for p in sorted(bb.preds, key=lambda p: cfg.index.index_of(p)):
+            copies = [(find(phi.dest), find(phi.operands[p.label])) for phi in bb_phis
+                      if phi.operands.get(p.label) in defined]
+            seq = sequentialize(copies, lambda d: new_temp(d, names, types))
+            insts = [ValueOperation({ "op": TrivialOpType.ID, "dest": d, "type": types[d], "args": [s] })
+                     for d, s in seq]
+            n_copies += len(insts)
+            if copy_at_end(p):
+                p.insts[-1:-1] = insts
+            else:  # the only predecessor of `bb`
+                bb.insts[0:0] = insts
+
+    # A phi leaves its dest undefined on the edges of undefined operands,
+    # give the names copied from such dests a value so the copies can run
+    read = set(find(arg) for bb_phis in phis.values() for phi in bb_phis
+               for arg in phi.operands.values() if arg in defined and find(arg) != find(phi.dest))
+    read.difference_update(arg['name'] for arg in function.args)
+    inits: dict[str, ValType] = {}
+    for bb, bb_phis in phis.items():
+        for phi in bb_phis:
+            dest = find(phi.dest)
+            if (dest in read and isinstance(phi.type, CoreValType)
+                and any(phi.operands.get(p.label) not in defined for p in bb.preds)):
+                inits[dest] = phi.type
+    cfg.entry_block.insts[0:0] = [Const({ "op": ConstOpType.CONST, "dest": var, "type": tp, "value": tp.py_type() })
+                                  for var, tp in sorted(inits.items())]
+
+    function.instrs = reconstruct_instructions(cfg)
+    return n_copies
+
+def new_temp(var: str, names: NameGenerator, types: dict[str, ValType]) -> str:
+    """Take a fresh temporary to hold `var` while breaking a copy cycle
+    """
+    temp = names.new_name(f"{var}.tmp")
+    types[temp] = types[var]
+    return temp
+
+def copy_at_end(bb: BasicBlock) -> bool:
+    """Whether copies for the successor of `bb` can go before its terminator,
+    i.e. it jumps unconditionally to a single successor
+    """
+    return bb.insts[-1].op == CtrlOpType.JMP
+
+def needs_copies(p: BasicBlock, s: BasicBlock, defined: set[str]) -> bool:
+    return any(phi.operands.get(p.label) in defined for phi in s.get_by_op(SsaOpType.PHI))
+
+def split_critical_edges(cfg: CFG, defined: set[str]) -> int:
+    """Split the edges whose copies can go neither at the end of the
+    predecessor nor at the start of the successor
+
+    Returns:
+        int: number of edges split
+    """
+    splits: list[tuple[BasicBlock, BasicBlock]] = []
+    for s in cfg.blocks.values():
+        if len(s.preds) < 2:
+            continue
+        for p in s.preds:
+            if not copy_at_end(p) and needs_copies(p, s, defined):
+                splits.append((p, s))
+    if len(splits) == 0:
+        return 0
+
+    position = { label: n for n, label in enumerate(cfg.blocks) }
+    splits.sort(key=lambda e: (position[e[0].label], position[e[1].label]))
+    after: dict[str, list[BasicBlock]] = {}
+    for p, s in splits:
+        bb = split_edge(cfg, p, s)
+        after.setdefault(p.label, []).append(bb)
+    # place each new block right after the predecessor it leaves
+    blocks: OrderedDict[str, BasicBlock] = OrderedDict()
+    for label, bb in cfg.blocks.items():
+        blocks[label] = bb
+        for new in after.get(label, []):
+            blocks[new.label] = new
+    cfg.blocks = blocks
+    cfg.invalidate_index()
+    return len(splits)
+
+def split_edge(cfg: CFG, p: BasicBlock, s: BasicBlock) -> BasicBlock:
+    """Insert a new block jumping to `s` on the edge `p -> s`,
+    the caller places it in `cfg.blocks`
+
+    Returns:
+        BasicBlock: the new block
+    """
+    label = cfg.label_names.new_name(f"{p.label}.{s.label}.")
+    bb = BasicBlock(label, [EffectOperation({ 'op': CtrlOpType.JMP, 'labels': [s.label] })])
+    last = p.insts[-1]
+    last.labels = tuple(label if l == s.label else l for l in last.labels)
+    p.succs.discard(s)
+    p.succs.add(bb)
+    s.preds.discard(p)
+    s.preds.add(bb)
+    bb.preds.add(p)
+    bb.succs.add(s)
+    for phi in s.get_by_op(SsaOpType.PHI):
+        if p.label in phi.operands:
+            phi.operands[label] = phi.operands.pop(p.label)
+    return bb
+
+class PhiCoalescer:
+    """Coalesce the names related by phi functions of a strict SSA `CFG`
+    into congruence classes whose live ranges don't interfere
+
+    Two names interfere if one is live at the definition of the other,
+    which must then be dominated by it. Phi dests are defined on entry of
+    their block and operands used on exit of the predecessor, so the copies
+    lowered there never clobber a live value.
+
+    Classes are checked for interference in linear time (Budimlic et al.,
+    Boissinot et al.): members are kept in dominance order, and in the
+    dominance forest of two merged classes only pairs of a name and its
+    nearest dominating name from the other class need to be checked.
+    """
+
+    def __init__(self, cfg: CFG):
+        self.cfg = cfg
+        self.index = cfg.index
+        self.numbering = DominatorTree(cfg).numbering
+        self.live = Liveness(cfg, ssa=True)
+        self.def_site: dict[str, tuple[int, int]] = {}
+        """block index and position of the definition of each name,
+        position `-1` for phi dests and function arguments
+        """
+        self.last_use: dict[tuple[str, int], int] = {}
+        """position of the last use of each name in each block index, phis excluded
+        """
+        for arg in cfg.function.args:
+            self.def_site[arg['name']] = (0, -1)
+        for b, bb in enumerate(self.index.blocks):
+            for n, i in enumerate(bb.insts):
+                if i.op == SsaOpType.PHI:
+                    self.def_site[i.dest] = (b, -1)
+                    continue
+                for arg in getattr(i, 'args', None) or []:
+                    self.last_use[(arg, b)] = n
+                if getattr(i, 'dest', None) is not None:
+                    self.def_site[i.dest] = (b, n)
+        self.rep: dict[str, str] = {}
+        """representative of each coalesced name, other than itself
+        """
+        self.members: dict[str, list[str]] = {}
+        """names of each congruence class in dominance order, by its representative
+        """
+
+    def find(self, var: str) -> str:
+        return self.rep.get(var, var)
+
+    def order(self, var: str) -> tuple[int, int, int]:
+        """Sort key of the definition of `var` in dominator tree preorder,
+        blocks unreachable from the entry come first
+        """
+        b, n = self.def_site[var]
+        return self.numbering.pre[b], b, n
+
+    def dominates(self, a: str, b: str) -> bool:
+        """Whether the definition of `a` dominates the one of `b`
+        """
+        (ba, pa), (bb, pb) = self.def_site[a], self.def_site[b]
+        if ba == bb:
+            return pa <= pb
+        return self.numbering.in_tree(ba) and self.numbering.dominates(ba, bb)
+
+    def interfere(self, a: str, b: str) -> bool:
+        """Whether `a`, whose definition dominates the one of `b`,
+        is still live after `b` is defined
+        """
+        bb, pb = self.def_site[b]
+        if self.def_site[a] == (bb, pb):  # defined together on entry
+            return True
+        return self.live.is_live_out(a, bb) or self.last_use.get((a, bb), -1) > pb
+
+    def interferes(self, names: list[str]) -> bool:
+        """Whether any two of `names`, given in dominance order, interfere
+        unless they are in the same class already
+
+        A name live at the definition of a name it dominates is also live at
+        the definitions in between, so only each name and its nearest
+        dominating one in the forest need to be checked.
+        """
+        ancestors: list[str] = []
+        for var in names:
+            while len(ancestors) > 0 and not self.dominates(ancestors[-1], var):
+                ancestors.pop()
+            if (len(ancestors) > 0
+                and self.find(ancestors[-1]) != self.find(var)
+                and self.interfere(ancestors[-1], var)):
+                return True
+            ancestors.append(var)
+        return False
+
+    def union(self, names: list[str]):
+        """Make `names`, given in dominance order, a class named after the first
+        """
+        root = names[0]
+        self.rep.pop(root, None)
+        for var in names:
+            self.members.pop(var, None)
+            if var != root:
+                self.rep[var] = root
+        self.members[root] = names
+
+    def try_union(self, a: str, b: str) -> bool:
+        """Merge the classes of `a` and `b` unless some members interfere
+
+        Returns:
+            bool: whether they are in the same class afterwards
+        """
+        ra, rb = self.find(a), self.find(b)
+        if ra == rb:
+            return True
+        merged = list(heapq.merge(self.members.get(ra, [ra]), self.members.get(rb, [rb]),
+                                  key=self.order))
+        if self.interferes(merged):
+            return False
+        self.union(merged)
+        return True
+
+    def coalesce(self) -> dict[str, str]:
+        """Coalesce each phi web, the names connected by phis, into one class
+        if it has no interference, else coalesce its phis one operand at a time
+
+        Returns:
+            dict[str, str]: representative of each name coalesced into another
+        """
+        web: dict[str, str] = {}
+        def find_web(var: str) -> str:
+            while web.get(var, var) != var:
+                web[var] = web.get(web[var], web[var])  # path halving
+                var = web[var]
+            return var
+
+        phis = [phi for bb in self.index.blocks for phi in bb.get_by_op(SsaOpType.PHI)]
+        for phi in phis:
+            for arg in phi.operands.values():
+                if arg in self.def_site:
+                    ra, rb = find_web(phi.dest), find_web(arg)
+                    web.setdefault(ra, ra)
+                    if ra != rb:
+                        web[rb] = ra
+        webs: dict[str, list[str]] = {}
+        web_phis: dict[str, list[Phi]] = {}
+        for var in self.def_site:
+            if var in web:
+                webs.setdefault(find_web(var), []).append(var)
+        for phi in phis:
+            web_phis.setdefault(find_web(phi.dest), []).append(phi)
+
+        for root, names in webs.items():
+            names.sort(key=self.order)
+            if not self.interferes(names):
+                self.union(names)
+                continue
+            for phi in web_phis[root]:
+                for arg in phi.operands.values():
+                    if arg in self.def_site:
+                        self.try_union(phi.dest, arg)
+        return self.rep
+
+def sequentialize(copies: list[tuple[str, str]],
+                  new_temp: Callable[[str], str]) -> list[tuple[str, str]]:
+    """Order the parallel copies `dest <- src` so that no source is
+    overwritten before it is read, breaking each cycle with a temporary
+
+    Args:
+        copies (list[tuple[str, str]]): `(dest, src)` pairs with distinct dests
+        new_temp (Callable[[str], str]): a fresh temporary to save the given name
+
+    Returns:
+        list[tuple[str, str]]: `(dest, src)` copies to run in order
+    """
+    pending = { d: s for d, s in copies if d != s }
+    readers: dict[str, list[str]] = {}
+    """pending copies reading each name
+    """
+    for d, s in pending.items():
+        readers.setdefault(s, []).append(d)
+    ready = [d for d in reversed(pending) if d not in readers]
+    seq: list[tuple[str, str]] = []
+    while len(pending) > 0:
+        while len(ready) > 0:
+            d = ready.pop()
+            s = pending.pop(d)
+            seq.append((d, s))
+            readers[s].remove(d)
+            if len(readers[s]) == 0 and s in pending:
+                ready.append(s)  # its last reader is done
+        if len(pending) > 0:
+            # only cycles left, every name read once, save one to break its cycle
+            d = next(iter(pending))
+            temp = new_temp(d)
+            seq.append((temp, d))
+            reader = readers.pop(d)[0]
+            pending[reader] = temp
+            readers[temp] = [reader]
+            ready.append(d)
+    return seq
@@ -1,6 +1,6 @@
 import abc
 import itertools
-from typing import Collection
+from typing import Collection, Iterable, Iterator
 
 def flatten(ll: Collection) -> list:
     """Flatten an iterable of iterable to a single list.
@@ -8,15 +8,58 @@ def flatten(ll: Collection) -> list:
     return list(itertools.chain(*ll))
 
 
-def new_name(prefix: str, names: Collection[str], count_from = 1):
-    """Generate a new name that is not in `names` starting with `prefix`.
-    Includes NO modification to `names`
+def iter_bits(bits: int) -> Iterator[int]:
+    """Iterate indices of set bits of a bitset `bits` in ascending order
     """
-    while True:
-        name = f"{prefix}{count_from}"
-        if name not in names:
-            return name
-        count_from += 1
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+def bits_of(indices: Collection[int]) -> int:
+    """Bitset with the bits of `indices` set
+    """
+    bits = 0
+    for i in indices:
+        bits |= 1 << i
+    return bits
+
+
+class NameGenerator:
+    """Generate new names `prefix` + counter that are not taken yet.
+
+    Names only ever get taken, so the counter of each prefix
+    resumes where the last search stopped instead of probing from the start.
+    """
+
+    def __init__(self, names: Iterable[str] = ()):
+        self.names = set(names)
+        """names already taken
+        """
+        self.counters: dict[str, int] = {}
+        """next counter to try for each prefix
+        """
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.names
+
+    def take(self, name: str):
+        """Mark `name` as taken
+        """
+        self.names.add(name)
+
+    def new_name(self, prefix: str, count_from: int = 1) -> str:
+        """Generate and take a new name starting with `prefix`,
+        counting from `count_from` the first time `prefix` is seen
+        """
+        count = self.counters.get(prefix, count_from)
+        name = f"{prefix}{count}"
+        while name in self.names:
+            count += 1
+            name = f"{prefix}{count}"
+        self.names.add(name)
+        self.counters[prefix] = count + 1
+        return name
 
 class Convertor(metaclass = abc.ABCMeta):
     @classmethod